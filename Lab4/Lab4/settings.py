@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "django.middleware.gzip.GZipMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -117,6 +119,18 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
 STATIC_URL = "static/"
+STATIC_ROOT = BASE_DIR / "staticfiles"
+
+# collectstatic fingerprints and gzip/brotli-compresses every asset, and
+# WhiteNoise serves the hashed names with immutable caching headers.
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -125,6 +139,14 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 LOGIN_URL = "login"
 
+# Forecasts live in memory; every change is journaled here and compacted
+# into a snapshot every WEATHER_STORE_SNAPSHOT_EVERY changes. Fsync policy:
+# "always", "interval" (every WEATHER_STORE_FSYNC_INTERVAL seconds) or "never".
+WEATHER_STORE_DIR = BASE_DIR / "data"
+WEATHER_STORE_FSYNC = "always"
+WEATHER_STORE_FSYNC_INTERVAL = 1.0
+WEATHER_STORE_SNAPSHOT_EVERY = 10_000
+
 STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
@@ -0,0 +1,93 @@
+"""Forecast lookups on plain lists vs WeatherStore.
+
+Usage: python benchmark.py [--forecasts 1000000] [--cities 1000] [--queries 1000]
+"""
+
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from weather_app.store import WeatherStore
+
+
+def make_forecasts(count, cities):
+    start = date(2021, 1, 1)
+    return [
+        {
+            "id": i,
+            "city_id": i % cities + 1,
+            "datetime": str(start + timedelta(days=i // cities)),
+            "forecasted_temperature": "20",
+            "forecasted_humidity": "50",
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def list_get(forecasts, forecast_id):
+    return next(
+        (forecast for forecast in forecasts if forecast["id"] == forecast_id), None
+    )
+
+
+def list_find(forecasts, city_id, date_from, date_to):
+    return [
+        forecast
+        for forecast in forecasts
+        if forecast["city_id"] == city_id
+        and datetime.strptime(forecast["datetime"], "%Y-%m-%d").date() >= date_from
+        and datetime.strptime(forecast["datetime"], "%Y-%m-%d").date() <= date_to
+    ]
+
+
+def timed(function, queries):
+    started = time.perf_counter()
+    for query in queries:
+        function(*query)
+    return (time.perf_counter() - started) / len(queries) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--forecasts", type=int, default=1_000_000)
+    parser.add_argument("--cities", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument(
+        "--list-queries",
+        type=int,
+        default=3,
+        help="the list scans take seconds each at 1M forecasts",
+    )
+    args = parser.parse_args()
+
+    forecasts = make_forecasts(args.forecasts, args.cities)
+    days = args.forecasts // args.cities
+    started = time.perf_counter()
+    store = WeatherStore(forecasts=forecasts)
+    print(f"store build: {time.perf_counter() - started:.2f}s")
+
+    rng = random.Random(0)
+    ids = [(rng.randint(1, args.forecasts),) for _ in range(args.queries)]
+    ranges = []
+    for _ in range(args.queries):
+        date_from = date(2021, 1, 1) + timedelta(days=rng.randrange(max(days, 1)))
+        ranges.append(
+            (rng.randint(1, args.cities), date_from, date_from + timedelta(days=30))
+        )
+
+    results = {
+        "get by id": (
+            timed(lambda i: list_get(forecasts, i), ids[: args.list_queries]),
+            timed(store.get_forecast, ids),
+        ),
+        "30-day range": (
+            timed(lambda *q: list_find(forecasts, *q), ranges[: args.list_queries]),
+            timed(store.find_forecasts, ranges),
+        ),
+    }
+    for name, (list_us, store_us) in results.items():
+        print(
+            f"{name:>12}: list {list_us:12.1f} us  store {store_us:8.2f} us  "
+            f"x{list_us / store_us:,.0f}"
+        )
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class Weather_appConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'weather_app'
+
+    def ready(self):
+        from .users import create_default_users
+
+        post_migrate.connect(create_default_users, sender=self)
@@ -0,0 +1,349 @@
+import gc
+import json
+import mmap
+import os
+import pickle
+import re
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+from .store import WeatherStore
+
+OPERATIONS = ("country", "city", "forecast", "delete_forecast")
+OPERATION_CODES = {operation: code for code, operation in enumerate(OPERATIONS)}
+TABLES = {
+    "countries": ("id", "name", "code"),
+    "cities": ("id", "name", "country_id"),
+    "forecasts": (
+        "id",
+        "city_id",
+        "datetime",
+        "forecasted_temperature",
+        "forecasted_humidity",
+    ),
+}
+# Journal record: payload length, CRC32 of the payload, operation code.
+RECORD_HEADER = struct.Struct("<IIB")
+SNAPSHOT_MAGIC = b"WXSNAP01"
+# Snapshot header after the magic: body length, CRC32 of the body.
+SNAPSHOT_HEADER = struct.Struct("<QI")
+FSYNC_POLICIES = ("always", "interval", "never")
+FILE_NAME = re.compile(r"(journal|snapshot)-(\d{8})\.(log|bin)")
+LOCK_FILE = "store.lock"
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class StoreLocked(RuntimeError):
+    """Another process already has the store open for writing."""
+
+
+def journal_path(directory, generation):
+    return directory / f"journal-{generation:08d}.log"
+
+
+def snapshot_path(directory, generation):
+    return directory / f"snapshot-{generation:08d}.bin"
+
+
+def generations(directory, kind):
+    return sorted(
+        int(match[2])
+        for match in map(FILE_NAME.fullmatch, os.listdir(directory))
+        if match and match[1] == kind
+    )
+
+
+def fsync_directory(directory):
+    # Makes a rename durable. Windows cannot open a directory for this.
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def lock_directory(directory):
+    """Take the exclusive writer lock on `directory` and return its file.
+
+    The lock lasts as long as the file stays open, and the OS drops it when
+    the process dies, so a crashed server never leaves the store locked.
+    """
+    file = open(directory / LOCK_FILE, "a+b")
+    try:
+        if os.name == "nt":
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        file.close()
+        raise StoreLocked(f"{directory} is already open in another process")
+    return file
+
+
+@contextmanager
+def gc_paused():
+    # Loading allocates millions of containers that all stay alive; cyclic
+    # GC passes over them during the load only burn time.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def encode(value):
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def write_snapshot(directory, generation, tables, next_ids):
+    """Atomically write `tables` as the base state of `generation`."""
+    # Snapshots are only ever read back by this process's own code, and
+    # unpickling is several times faster than parsing JSON at this size.
+    body = pickle.dumps(
+        {
+            "next_ids": next_ids,
+            **{
+                table: [
+                    [record[field] for field in fields]
+                    for record in tables[table].values()
+                ]
+                for table, fields in TABLES.items()
+            },
+        },
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    path = snapshot_path(directory, generation)
+    temporary = path.with_suffix(".tmp")
+    with open(temporary, "wb") as file:
+        file.write(SNAPSHOT_MAGIC)
+        file.write(SNAPSHOT_HEADER.pack(len(body), zlib.crc32(body)))
+        file.write(body)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    fsync_directory(directory)
+
+
+def read_snapshot(path):
+    with open(path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data, memoryview(data) as view:
+        start = len(SNAPSHOT_MAGIC) + SNAPSHOT_HEADER.size
+        if view[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a snapshot")
+        length, checksum = SNAPSHOT_HEADER.unpack_from(view, len(SNAPSHOT_MAGIC))
+        with view[start : start + length] as body:
+            if len(body) != length or zlib.crc32(body) != checksum:
+                raise ValueError(f"{path} is corrupt")
+            state = pickle.loads(body)
+    tables = {
+        table: {row[0]: dict(zip(fields, row)) for row in state[table]}
+        for table, fields in TABLES.items()
+    }
+    return tables, state["next_ids"]
+
+
+def replay_journal(path, tables, next_ids):
+    """Apply a journal's records to `tables` and return how many were read.
+
+    A torn or corrupt record ends the journal: it and anything after it are
+    cut off so new records are appended to a clean tail.
+    """
+    size = path.stat().st_size
+    offset = count = 0
+    if size:
+        with open(path, "rb") as file, mmap.mmap(
+            file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            while offset + RECORD_HEADER.size <= size:
+                length, checksum, code = RECORD_HEADER.unpack_from(data, offset)
+                start = offset + RECORD_HEADER.size
+                payload = data[start : start + length]
+                if (
+                    len(payload) != length
+                    or zlib.crc32(payload) != checksum
+                    or code >= len(OPERATIONS)
+                ):
+                    break
+                apply(tables, next_ids, OPERATIONS[code], json.loads(payload))
+                offset = start + length
+                count += 1
+    if offset < size:
+        os.truncate(path, offset)
+    return count
+
+
+def apply(tables, next_ids, operation, record):
+    table = {
+        "country": "countries",
+        "city": "cities",
+        "forecast": "forecasts",
+        "delete_forecast": "forecasts",
+    }[operation]
+    if operation == "delete_forecast":
+        tables[table].pop(record["id"], None)
+    else:
+        tables[table][record["id"]] = record
+    next_ids[table] = max(next_ids.get(table, 1), record["id"] + 1)
+
+
+class Journal:
+    """Append-only binary log of store changes, compacted into snapshots.
+
+    Generation N is snapshot-N.bin, the whole state at some moment, plus
+    journal-N.log, every change made after it. A checkpoint starts the next
+    generation and writes its snapshot from the store's current immutable
+    snapshot, so writers only wait for the journal file to be swapped.
+
+    Only the process holding the directory's lock file has a journal, so
+    only it ever appends, checkpoints or deletes generations.
+
+    fsync: "always" syncs every record, "interval" at most once every
+    `fsync_interval` seconds and "never" leaves it to the OS. Records are
+    flushed to the OS either way, so only a machine crash can lose them.
+    """
+
+    def __init__(
+        self,
+        directory,
+        generation,
+        lock_file,
+        fsync="always",
+        fsync_interval=1.0,
+        snapshot_every=10_000,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}")
+        self.directory = Path(directory)
+        self.generation = generation
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.records = 0
+        self.synced_at = time.monotonic()
+        self.checkpoint_lock = threading.Lock()
+        self.lock_file = lock_file
+        self.file = open(journal_path(self.directory, generation), "ab")
+
+    def append(self, operation, record):
+        """Log one change. Callers hold the store's write lock."""
+        payload = encode(record)
+        self.file.write(
+            RECORD_HEADER.pack(
+                len(payload), zlib.crc32(payload), OPERATION_CODES[operation]
+            )
+        )
+        self.file.write(payload)
+        self.file.flush()
+        if self.fsync == "always" or (
+            self.fsync == "interval"
+            and time.monotonic() - self.synced_at >= self.fsync_interval
+        ):
+            os.fsync(self.file.fileno())
+            self.synced_at = time.monotonic()
+        self.records += 1
+
+    def checkpoint_due(self):
+        return self.records >= self.snapshot_every
+
+    def _rotate(self):
+        if self.fsync != "never":
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.generation += 1
+        self.records = 0
+        self.file = open(journal_path(self.directory, self.generation), "ab")
+        return self.generation
+
+    def checkpoint(self, store):
+        """Snapshot `store` and drop the generations the snapshot replaces."""
+        if not self.checkpoint_lock.acquire(blocking=False):
+            return
+        try:
+            with store.lock:
+                snapshot = store.snapshot
+                next_ids = dict(store.next_ids)
+                generation = self._rotate()
+            tables = {table: getattr(snapshot, table) for table in TABLES}
+            write_snapshot(self.directory, generation, tables, next_ids)
+            for kind, path in (("snapshot", snapshot_path), ("journal", journal_path)):
+                for old in generations(self.directory, kind):
+                    if old < generation:
+                        os.remove(path(self.directory, old))
+        finally:
+            self.checkpoint_lock.release()
+
+    def close(self):
+        self.file.close()
+        self.lock_file.close()
+
+
+def open_store(directory, countries=(), cities=(), forecasts=(), **options):
+    """Recover a WeatherStore from `directory`, seeding it on first use.
+
+    The newest snapshot is loaded and only the journals written since it are
+    replayed, so recovery time follows the snapshot size, not the history.
+    The directory is locked for as long as the store is open; a second
+    process opening it gets StoreLocked instead of a journal of its own.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    lock_file = lock_directory(directory)
+    try:
+        with gc_paused():
+            store, replayed = _load(
+                directory, countries, cities, forecasts, lock_file, options
+            )
+    except BaseException:
+        lock_file.close()
+        raise
+    if replayed:
+        store.journal.checkpoint(store)
+    return store
+
+
+def _load(directory, countries, cities, forecasts, lock_file, options):
+    snapshots = generations(directory, "snapshot")
+    if snapshots:
+        generation = snapshots[-1]
+        tables, next_ids = read_snapshot(snapshot_path(directory, generation))
+    elif generations(directory, "journal"):
+        generation, next_ids = 0, {}
+        tables = {table: {} for table in TABLES}
+    else:
+        generation, next_ids = 0, {}
+        tables = {
+            table: {record["id"]: dict(record) for record in records}
+            for table, records in (
+                ("countries", countries),
+                ("cities", cities),
+                ("forecasts", forecasts),
+            )
+        }
+        write_snapshot(directory, generation, tables, next_ids)
+
+    replayed = 0
+    journals = [old for old in generations(directory, "journal") if old >= generation]
+    for old in journals:
+        replayed += replay_journal(journal_path(directory, old), tables, next_ids)
+    journal = Journal(
+        directory, max(journals, default=generation), lock_file, **options
+    )
+    store = WeatherStore(
+        *(tables[table].values() for table in TABLES),
+        next_ids=next_ids,
+        journal=journal,
+    )
+    return store, replayed
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from weather_app.users import create_default_users
+
+
+class Command(BaseCommand):
+    help = "Create the superadmin and user1 accounts if they do not exist yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        created = create_default_users(using=options["database"])
+        if created:
+            self.stdout.write(self.style.SUCCESS(f"Created {', '.join(created)}"))
+        else:
+            self.stdout.write("Default users already exist")
@@ -0,0 +1,336 @@
+import bisect
+import math
+import threading
+from datetime import date
+
+# Forecast ids are grouped into shards of 2 ** SHARD_BITS consecutive ids.
+SHARD_BITS = 10
+
+def parse_date(value):
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def forecast_key(forecast):
+    return parse_date(forecast["datetime"]), forecast["id"]
+
+
+class ShardedMap:
+    """Immutable id -> record map split into shards by id.
+
+    A change returns a new map that copies the one shard it touches and the
+    list of shards, 2 ** SHARD_BITS times shorter than the map, and shares
+    every other shard with the old map, which stays as it was.
+    """
+
+    __slots__ = ("shards", "length")
+
+    def __init__(self, records=None):
+        self.shards = {}
+        for key, record in (records or {}).items():
+            self.shards.setdefault(key >> SHARD_BITS, {})[key] = record
+        self.length = len(records or ())
+
+    def _with_shard(self, shard_key, shard, length):
+        new = ShardedMap()
+        new.shards = {**self.shards, shard_key: shard}
+        if not shard:
+            del new.shards[shard_key]
+        new.length = length
+        return new
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, key):
+        return key in self.shards.get(key >> SHARD_BITS, ())
+
+    def __getitem__(self, key):
+        return self.shards.get(key >> SHARD_BITS, {})[key]
+
+    def get(self, key, default=None):
+        return self.shards.get(key >> SHARD_BITS, {}).get(key, default)
+
+    def values(self):
+        for shard in self.shards.values():
+            yield from shard.values()
+
+    def set(self, key, record):
+        shard_key = key >> SHARD_BITS
+        shard = dict(self.shards.get(shard_key, ()))
+        length = self.length if key in shard else self.length + 1
+        shard[key] = record
+        return self._with_shard(shard_key, shard, length)
+
+    def pop(self, key):
+        """Remove `key` and return the new map and the removed record."""
+        shard_key = key >> SHARD_BITS
+        shard = dict(self.shards.get(shard_key, ()))
+        record = shard.pop(key)
+        return self._with_shard(shard_key, shard, self.length - 1), record
+
+
+class Snapshot:
+    """One immutable version of the store's data.
+
+    Neither a snapshot nor the records in it are changed after it has been
+    published, so readers can use one without holding any lock.
+    """
+
+    __slots__ = (
+        "version",
+        "countries",
+        "cities",
+        "cities_by_name",
+        "forecasts",
+        "forecast_keys",
+    )
+
+    def __init__(
+        self, version, countries, cities, cities_by_name, forecasts, forecast_keys
+    ):
+        self.version = version
+        self.countries = countries
+        self.cities = cities
+        self.cities_by_name = cities_by_name
+        self.forecasts = forecasts
+        self.forecast_keys = forecast_keys
+
+    def replace(self, **changes):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes, version=self.version + 1)
+        return Snapshot(**fields)
+
+    def list_countries(self):
+        return list(self.countries.values())
+
+    def list_cities(self):
+        return list(self.cities.values())
+
+    def get_country(self, country_id):
+        return self.countries.get(int(country_id))
+
+    def get_city(self, city_id):
+        return self.cities.get(int(city_id))
+
+    def get_city_by_name(self, name):
+        return self.cities_by_name.get(name)
+
+    def get_forecast(self, forecast_id):
+        return self.forecasts.get(int(forecast_id))
+
+    def find_forecasts(self, city_id, date_from=None, date_to=None):
+        """Forecasts of a city ordered by date, both bounds inclusive."""
+        keys = self.forecast_keys.get(city_id, ())
+        start = 0 if date_from is None else bisect.bisect_left(keys, (date_from,))
+        end = (
+            len(keys)
+            if date_to is None
+            else bisect.bisect_right(keys, (date_to, math.inf))
+        )
+        return [self.forecasts[forecast_id] for _, forecast_id in keys[start:end]]
+
+
+class WeatherStore:
+    """In-memory countries, cities and forecasts with indexed lookups.
+
+    Records are kept in id -> record dicts, forecasts in a ShardedMap.
+    Forecasts are also indexed per city by (date, id), kept sorted, so a
+    date range is two bisects away and no forecast date is parsed more than
+    once.
+
+    The data is published as copy-on-write snapshots: readers take
+    `store.snapshot` without locking, while writers serialize on one lock,
+    copy only what they change and swap in the new snapshot. A forecast
+    write copies one shard and one city's index, not every forecast. With a
+    journal every change is logged before it is published.
+    """
+
+    def __init__(
+        self, countries=(), cities=(), forecasts=(), next_ids=None, journal=None
+    ):
+        countries = {country["id"]: dict(country) for country in countries}
+        cities = {city["id"]: dict(city) for city in cities}
+        forecasts = {forecast["id"]: dict(forecast) for forecast in forecasts}
+        forecast_keys = {}
+        for forecast in forecasts.values():
+            forecast_keys.setdefault(forecast["city_id"], []).append(
+                forecast_key(forecast)
+            )
+        for keys in forecast_keys.values():
+            keys.sort()
+        self.snapshot = Snapshot(
+            0,
+            countries,
+            cities,
+            {city["name"]: city for city in cities.values()},
+            ShardedMap(forecasts),
+            forecast_keys,
+        )
+        self.lock = threading.Lock()
+        self.next_ids = {
+            table: max((next_ids or {}).get(table, 1), max(records, default=0) + 1)
+            for table, records in (
+                ("countries", countries),
+                ("cities", cities),
+                ("forecasts", forecasts),
+            )
+        }
+        self.journal = journal
+
+    def _next_id(self, table):
+        next_id = self.next_ids[table]
+        self.next_ids[table] = next_id + 1
+        return next_id
+
+    def _publish(self, snapshot, operation, record):
+        if self.journal is not None:
+            self.journal.append(operation, record)
+        self.snapshot = snapshot
+
+    def _written(self):
+        if self.journal is not None and self.journal.checkpoint_due():
+            self.journal.checkpoint(self)
+
+    def list_countries(self):
+        return self.snapshot.list_countries()
+
+    def list_cities(self):
+        return self.snapshot.list_cities()
+
+    def get_country(self, country_id):
+        return self.snapshot.get_country(country_id)
+
+    def get_city(self, city_id):
+        return self.snapshot.get_city(city_id)
+
+    def get_city_by_name(self, name):
+        return self.snapshot.get_city_by_name(name)
+
+    def get_forecast(self, forecast_id):
+        return self.snapshot.get_forecast(forecast_id)
+
+    def find_forecasts(self, city_id, date_from=None, date_to=None):
+        return self.snapshot.find_forecasts(city_id, date_from, date_to)
+
+    def add_country(self, name, code):
+        with self.lock:
+            snapshot = self.snapshot
+            country = {"id": self._next_id("countries"), "name": name, "code": code}
+            self._publish(
+                snapshot.replace(
+                    countries={**snapshot.countries, country["id"]: country}
+                ),
+                "country",
+                country,
+            )
+        self._written()
+        return country
+
+    def add_city(self, name, country_id):
+        with self.lock:
+            snapshot = self.snapshot
+            city = {
+                "id": self._next_id("cities"),
+                "name": name,
+                "country_id": country_id,
+            }
+            self._publish(
+                snapshot.replace(
+                    cities={**snapshot.cities, city["id"]: city},
+                    cities_by_name={**snapshot.cities_by_name, city["name"]: city},
+                ),
+                "city",
+                city,
+            )
+        self._written()
+        return city
+
+    @staticmethod
+    def _with_key(forecast_keys, city_id, change):
+        keys = list(forecast_keys.get(city_id, ()))
+        change(keys)
+        return {**forecast_keys, city_id: keys}
+
+    def _put_forecast(self, snapshot, forecast, previous=None):
+        key = forecast_key(forecast)
+        forecast_keys = snapshot.forecast_keys
+        if previous is not None:
+            previous_key = forecast_key(previous)
+            forecast_keys = self._with_key(
+                forecast_keys,
+                previous["city_id"],
+                lambda keys: keys.pop(bisect.bisect_left(keys, previous_key)),
+            )
+        forecast_keys = self._with_key(
+            forecast_keys,
+            forecast["city_id"],
+            lambda keys: bisect.insort(keys, key),
+        )
+        forecasts = snapshot.forecasts.set(forecast["id"], forecast)
+        self._publish(
+            snapshot.replace(forecasts=forecasts, forecast_keys=forecast_keys),
+            "forecast",
+            forecast,
+        )
+        return forecast
+
+    def add_forecast(
+        self, city_id, datetime, forecasted_temperature, forecasted_humidity
+    ):
+        parse_date(datetime)
+        with self.lock:
+            forecast = {
+                "id": self._next_id("forecasts"),
+                "city_id": city_id,
+                "datetime": datetime,
+                "forecasted_temperature": forecasted_temperature,
+                "forecasted_humidity": forecasted_humidity,
+            }
+            self._put_forecast(self.snapshot, forecast)
+        self._written()
+        return forecast
+
+    def update_forecast(
+        self,
+        forecast_id,
+        city_id,
+        datetime,
+        forecasted_temperature,
+        forecasted_humidity,
+    ):
+        parse_date(datetime)
+        with self.lock:
+            snapshot = self.snapshot
+            previous = snapshot.forecasts[int(forecast_id)]
+            forecast = {
+                **previous,
+                "city_id": city_id,
+                "datetime": datetime,
+                "forecasted_temperature": forecasted_temperature,
+                "forecasted_humidity": forecasted_humidity,
+            }
+            self._put_forecast(snapshot, forecast, previous)
+        self._written()
+        return forecast
+
+    def delete_forecast(self, forecast_id):
+        with self.lock:
+            snapshot = self.snapshot
+            forecasts, forecast = snapshot.forecasts.pop(int(forecast_id))
+            key = forecast_key(forecast)
+            self._publish(
+                snapshot.replace(
+                    forecasts=forecasts,
+                    forecast_keys=self._with_key(
+                        snapshot.forecast_keys,
+                        forecast["city_id"],
+                        lambda keys: keys.pop(bisect.bisect_left(keys, key)),
+                    ),
+                ),
+                "delete_forecast",
+                {"id": forecast["id"]},
+            )
+        self._written()
+        return forecast
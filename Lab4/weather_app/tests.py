@@ -1,3 +1,278 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from datetime import date
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from . import journal, views
+from .journal import (
+    OPERATION_CODES,
+    RECORD_HEADER,
+    StoreLocked,
+    generations,
+    journal_path,
+    open_store,
+)
+from .store import SHARD_BITS, ShardedMap, WeatherStore
+
+
+def forecast(forecast_id, city_id, day):
+    return {
+        "id": forecast_id,
+        "city_id": city_id,
+        "datetime": f"2021-10-{day:02d}",
+        "forecasted_temperature": "20",
+        "forecasted_humidity": "50",
+    }
+
+
+def ids(forecasts):
+    return [forecast["id"] for forecast in forecasts]
+
+
+class FindForecastsTests(SimpleTestCase):
+    def setUp(self):
+        self.store = WeatherStore(
+            forecasts=[
+                forecast(1, 1, 12),
+                forecast(5, 1, 11),
+                forecast(2, 1, 10),
+                forecast(3, 1, 11),
+                forecast(4, 2, 11),
+            ]
+        )
+
+    def test_open_bounds_return_every_forecast_of_the_city(self):
+        self.assertEqual(ids(self.store.find_forecasts(1)), [2, 3, 5, 1])
+        self.assertEqual(ids(self.store.find_forecasts(2)), [4])
+
+    def test_bounds_are_inclusive(self):
+        find = self.store.find_forecasts
+
+        self.assertEqual(
+            ids(find(1, date(2021, 10, 11), date(2021, 10, 12))), [3, 5, 1]
+        )
+        self.assertEqual(ids(find(1, date(2021, 10, 11), date(2021, 10, 11))), [3, 5])
+        self.assertEqual(ids(find(1, date(2021, 10, 11))), [3, 5, 1])
+        self.assertEqual(ids(find(1, date_to=date(2021, 10, 11))), [2, 3, 5])
+
+    def test_empty_ranges(self):
+        find = self.store.find_forecasts
+
+        self.assertEqual(find(1, date(2021, 10, 13)), [])
+        self.assertEqual(find(1, date_to=date(2021, 10, 9)), [])
+        self.assertEqual(find(1, date(2021, 10, 12), date(2021, 10, 11)), [])
+        self.assertEqual(find(3), [])
+
+    def test_equal_dates_are_ordered_by_id(self):
+        added = self.store.add_forecast(1, "2021-10-11", "21", "51")
+        self.store.update_forecast(2, 1, "2021-10-11", "22", "52")
+
+        self.assertEqual(
+            ids(self.store.find_forecasts(1, date(2021, 10, 11), date(2021, 10, 11))),
+            [2, 3, 5, added["id"]],
+        )
+
+
+class SnapshotTests(SimpleTestCase):
+    def test_a_held_snapshot_is_unchanged_by_writes(self):
+        store = WeatherStore(forecasts=[forecast(1, 1, 10), forecast(2, 1, 11)])
+        snapshot = store.snapshot
+        before = [dict(forecast) for forecast in snapshot.find_forecasts(1)]
+
+        store.add_forecast(1, "2021-10-09", "21", "51")
+        store.update_forecast(1, 2, "2021-10-12", "22", "52")
+        store.delete_forecast(2)
+
+        self.assertEqual(snapshot.find_forecasts(1), before)
+        self.assertEqual(snapshot.get_forecast(1), before[0])
+        self.assertEqual(len(snapshot.forecasts), 2)
+        self.assertEqual(ids(store.find_forecasts(1)), [3])
+        self.assertEqual(ids(store.find_forecasts(2)), [1])
+        self.assertIsNone(store.get_forecast(2))
+
+    def test_a_write_copies_only_the_shard_it_changes(self):
+        other = 5 << SHARD_BITS
+        forecasts = ShardedMap({1: "first", other: "other"})
+
+        changed = forecasts.set(2, "second")
+        emptied, record = changed.pop(other)
+
+        self.assertIs(
+            changed.shards[other >> SHARD_BITS], forecasts.shards[other >> SHARD_BITS]
+        )
+        self.assertEqual(list(forecasts.values()), ["first", "other"])
+        self.assertEqual(len(changed), 3)
+        self.assertEqual(record, "other")
+        self.assertNotIn(other, emptied)
+        self.assertEqual(len(emptied), 2)
+        self.assertIn(other, changed)
+
+
+def state(store):
+    snapshot = store.snapshot
+    return (
+        snapshot.list_countries(),
+        snapshot.list_cities(),
+        sorted(snapshot.forecasts.values(), key=lambda forecast: forecast["id"]),
+        dict(store.next_ids),
+    )
+
+
+def record(operation, value):
+    payload = json.dumps(value).encode()
+    return (
+        RECORD_HEADER.pack(
+            len(payload), zlib.crc32(payload), OPERATION_CODES[operation]
+        )
+        + payload
+    )
+
+
+class JournalTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open(self, **options):
+        store = open_store(
+            self.directory, views.COUNTRIES, views.CITIES, views.FORECASTS, **options
+        )
+        self.addCleanup(store.journal.close)
+        return store
+
+    def reopen(self, store, **options):
+        store.journal.close()
+        return self.open(**options)
+
+    def test_reopen_recovers_the_same_store(self):
+        store = self.open()
+        store.add_country("Germany", "DE")
+        store.add_city("Berlin", 3)
+        store.add_forecast(4, "2021-10-12", "18", "60")
+        store.update_forecast(1, 2, "2021-10-13", "19", "61")
+        store.delete_forecast(2)
+
+        reopened = self.reopen(store)
+
+        self.assertEqual(state(reopened), state(store))
+        self.assertEqual(ids(reopened.find_forecasts(2)), ids(store.find_forecasts(2)))
+
+    def test_a_torn_or_corrupt_last_record_is_dropped(self):
+        for damage in ("truncate", "corrupt"):
+            with self.subTest(damage=damage):
+                shutil.rmtree(self.directory)
+                store = self.open()
+                store.add_forecast(1, "2021-10-12", "18", "60")
+                kept = state(store)
+                store.add_forecast(1, "2021-10-13", "19", "61")
+                store.journal.close()
+                path = journal_path(self.directory, store.journal.generation)
+                if damage == "truncate":
+                    os.truncate(path, path.stat().st_size - 3)
+                else:
+                    data = bytearray(path.read_bytes())
+                    data[-2] ^= 0xFF
+                    path.write_bytes(data)
+
+                reopened = self.open()
+
+                self.assertEqual(state(reopened), kept)
+                # New records go after the last intact one.
+                added = reopened.add_forecast(1, "2021-10-14", "20", "62")
+                self.assertEqual(state(self.reopen(reopened))[2][-1], added)
+
+    def test_recovery_replays_only_journals_newer_than_the_snapshot(self):
+        store = self.open()
+        store.add_forecast(1, "2021-10-12", "18", "60")
+        store.journal.checkpoint(store)
+        store.add_forecast(1, "2021-10-13", "19", "61")
+        expected = state(store)
+        generation = store.journal.generation
+        store.journal.close()
+        # A journal older than the snapshot that replay would wrongly apply.
+        journal_path(self.directory, generation - 1).write_bytes(
+            record("delete_forecast", {"id": 1})
+        )
+
+        with mock.patch.object(
+            journal, "replay_journal", wraps=journal.replay_journal
+        ) as replay_journal:
+            reopened = self.open()
+
+        self.assertEqual(
+            [call.args[0] for call in replay_journal.call_args_list],
+            [journal_path(self.directory, generation)],
+        )
+        self.assertEqual(state(reopened), expected)
+        # Recovery checkpoints the replayed records and drops old generations.
+        self.assertEqual(generations(self.directory, "journal"), [generation + 1])
+
+    def test_a_second_open_store_raises_store_locked(self):
+        store = self.open()
+
+        with self.assertRaises(StoreLocked):
+            open_store(self.directory)
+
+        store.journal.close()
+        self.open()
+
+
+class StoreTestCase(TestCase):
+    """Serves the views from a new store in a temporary directory."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store_settings = override_settings(WEATHER_STORE_DIR=directory)
+        store_settings.enable()
+        self.addCleanup(store_settings.disable)
+        views._store = None
+        self.addCleanup(self.close_store)
+        self.staff = User.objects.create_user(
+            "staff", password="password", is_staff=True
+        )
+        self.client.force_login(self.staff)
+
+    def close_store(self):
+        if views._store is not None:
+            views._store.journal.close()
+            views._store = None
+
+
+class InvalidDateTests(StoreTestCase):
+    error_url = reverse(
+        "error_view", kwargs={"code": "400", "detail": "Invalid datetime format"}
+    )
+    data = {
+        "city_id": 2,
+        "forecast_datetime": "2021-13-45",
+        "forecasted_temperature": "20",
+        "forecasted_humidity": "50",
+    }
+
+    def test_create_forecast_rejects_an_invalid_date(self):
+        response = self.client.post(reverse("create_forecast"), self.data)
+
+        self.assertRedirects(response, self.error_url, fetch_redirect_response=False)
+        self.assertEqual(
+            len(views.get_store().snapshot.forecasts), len(views.FORECASTS)
+        )
+
+    def test_update_forecast_rejects_an_invalid_date(self):
+        # "forecasts/<str:city_name>/" is matched first and shadows the URL of
+        # update_forecast, so the view is called directly.
+        request = RequestFactory().post("/", self.data)
+        request.user = self.staff
+
+        response = views.update_forecast(request, 1)
+
+        self.assertRedirects(response, self.error_url, fetch_redirect_response=False)
+        self.assertEqual(views.get_store().get_forecast(1), views.FORECASTS[0])
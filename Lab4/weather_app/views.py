@@ -1,14 +1,15 @@
+from django.conf import settings
 from django.contrib.auth import logout, login, authenticate
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.forms import UserCreationForm
-from django.contrib.auth.models import User
 from django.http import HttpResponseRedirect, HttpResponseForbidden, HttpResponse
 from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
-from dotenv import load_dotenv
 from datetime import datetime
-import os
+import threading
+
+from .journal import open_store
 
 COUNTRIES = [
     {"id": 1, "name": "Ukraine", "code": "UA"},
@@ -66,33 +67,35 @@ FORECASTS = [
     },
 ]
 
+_store = None
+_store_lock = threading.Lock()
 
-def create_user():
-    user = User.objects.create_user("user1", "myemail@example.com", "password1")
-    user.first_name = "John"
-    user.last_name = "Doe"
-    user.save()
-
-def create_superadmin():
-    load_dotenv()
-    EMAIL = os.getenv("SUPERADMIN_EMAIL")
-    PASSWORD = os.getenv("SUPERADMIN_PASSWORD")
-    user = User.objects.create_user("superadmin", EMAIL, PASSWORD)
-    user.is_superuser = True
-    user.is_staff = True
-    user.save()
 
+def get_store():
+    """The weather store, recovered on the first request that needs it.
 
-try:
-    create_superadmin()
-    create_user()
-except Exception:
-    pass
+    Management commands import this module too; opening the store lazily
+    keeps them from loading it or locking it away from the server.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = open_store(
+                    settings.WEATHER_STORE_DIR,
+                    COUNTRIES,
+                    CITIES,
+                    FORECASTS,
+                    fsync=settings.WEATHER_STORE_FSYNC,
+                    fsync_interval=settings.WEATHER_STORE_FSYNC_INTERVAL,
+                    snapshot_every=settings.WEATHER_STORE_SNAPSHOT_EVERY,
+                )
+    return _store
 
 
 def index(request):
     if request.method == "GET":
-        return render(request, "index.html", {"cities": CITIES, "user": request.user})
+        return render(request, "index.html", {"cities": get_store().list_cities(), "user": request.user})
     
 def is_staff_user(user):
     return user.is_authenticated and user.is_staff
@@ -116,18 +119,15 @@ def add_city(request):
     if request.method == "POST":
         country_id = request.POST["country_id"]
         city_name = request.POST["city_name"]
-        country = next(
-            (country for country in COUNTRIES if country["id"] == int(country_id)), None
-        )
-        city_id = len(CITIES) + 1
-        city = {"id": city_id, "name": city_name, "country_id": country["id"]}
-        CITIES.append(city)
+        store = get_store()
+        country = store.get_country(country_id)
+        store.add_city(city_name, country["id"])
         return HttpResponseRedirect(reverse("index"))
     else:  # Handle 'GET' request
         return render(
             request,
             "add_city.html",
-            {"countries": COUNTRIES, "user": request.user},
+            {"countries": get_store().list_countries(), "user": request.user},
         )
 
 
@@ -135,14 +135,12 @@ def add_city(request):
 @user_passes_test(is_staff_user, login_url='/access_denied/')
 def edit_forecast(request, forecast_id):
     if request.method == "GET":
-        forecast = next(
-            (forecast for forecast in FORECASTS if forecast["id"] == int(forecast_id)),
-            None,
-        )
+        store = get_store()
+        forecast = store.get_forecast(forecast_id)
         return render(
             request,
             "edit_forecast.html",
-            {"forecast": forecast, "cities": CITIES, "user": request.user},
+            {"forecast": forecast, "cities": store.list_cities(), "user": request.user},
         )
 
 
@@ -150,22 +148,23 @@ def edit_forecast(request, forecast_id):
 @user_passes_test(is_staff_user, login_url='/access_denied/')
 def create_forecast(request):
     if request.method == "GET":
-        return render(request, "create_forecast.html", {"cities": CITIES})
+        return render(request, "create_forecast.html", {"cities": get_store().list_cities()})
     elif request.method == "POST":
         city_id = request.POST["city_id"]
         forecast_datetime = request.POST["forecast_datetime"]
         forecasted_temperature = request.POST["forecasted_temperature"]
         forecasted_humidity = request.POST["forecasted_humidity"]
-        city = next((city for city in CITIES if city["id"] == int(city_id)), None)
-        city_id = len(FORECASTS) + 1
-        forecast = {
-            "id": city_id,
-            "city_id": city["id"],
-            "datetime": forecast_datetime,
-            "forecasted_temperature": forecasted_temperature,
-            "forecasted_humidity": forecasted_humidity,
-        }
-        FORECASTS.append(forecast)
+        store = get_store()
+        city = store.get_city(city_id)
+        try:
+            store.add_forecast(
+                city["id"],
+                forecast_datetime,
+                forecasted_temperature,
+                forecasted_humidity,
+            )
+        except ValueError:
+            return redirect('error_view', code="400", detail="Invalid datetime format")
         return HttpResponseRedirect(reverse("index"))
 
 
@@ -176,9 +175,7 @@ def add_country(request):
     if request.method == "POST":
         country_name = request.POST["country_name"]
         country_code = request.POST["country_code"]
-        city_id = len(COUNTRIES) + 1
-        country = {"id": city_id, "name": country_name, "code": country_code}
-        COUNTRIES.append(country)
+        get_store().add_country(country_name, country_code)
         return HttpResponseRedirect(reverse("index"))
     else:
         return render(request, "add_country.html", {"user": request.user})
@@ -187,7 +184,8 @@ def add_country(request):
 @login_required
 def get_forecast(request, city_name):
     if request.method == "GET":
-        city = next((city for city in CITIES if city["name"] == city_name), None)
+        snapshot = get_store().snapshot
+        city = snapshot.get_city_by_name(city_name)
         if not city:
             return redirect('error_view', code="404", detail="City not found")
         
@@ -205,12 +203,8 @@ def get_forecast(request, city_name):
         except ValueError as e:
             return redirect('error_view', code="400", detail="Invalid datetime format")
 
-        forecasts = [
-            forecast for forecast in FORECASTS if forecast["city_id"] == city["id"] and
-            (not datetime_from or datetime.strptime(forecast["datetime"], "%Y-%m-%d").date() >= datetime_from) and
-            (not datetime_to or datetime.strptime(forecast["datetime"], "%Y-%m-%d").date() <= datetime_to)
-        ]
-        return render(request, "forecasts.html", {"forecasts": forecasts, "cities": CITIES, "user": request.user})
+        forecasts = snapshot.find_forecasts(city["id"], datetime_from or None, datetime_to or None)
+        return render(request, "forecasts.html", {"forecasts": forecasts, "cities": snapshot.list_cities(), "user": request.user})
 
 
 @csrf_exempt
@@ -222,15 +216,18 @@ def update_forecast(request, forecast_id):
         forecast_datetime = request.POST["forecast_datetime"]
         forecasted_temperature = request.POST["forecasted_temperature"]
         forecasted_humidity = request.POST["forecasted_humidity"]
-        city = next((city for city in CITIES if city["id"] == int(city_id)), None)
-        forecast = next(
-            (forecast for forecast in FORECASTS if forecast["id"] == int(forecast_id)),
-            None,
-        )
-        forecast["city"] = city
-        forecast["datetime"] = forecast_datetime
-        forecast["forecasted_temperature"] = forecasted_temperature
-        forecast["forecasted_humidity"] = forecasted_humidity
+        store = get_store()
+        city = store.get_city(city_id)
+        try:
+            store.update_forecast(
+                forecast_id,
+                city["id"],
+                forecast_datetime,
+                forecasted_temperature,
+                forecasted_humidity,
+            )
+        except ValueError:
+            return redirect('error_view', code="400", detail="Invalid datetime format")
         return HttpResponseRedirect(reverse("index"))
 
 
@@ -238,11 +235,7 @@ def update_forecast(request, forecast_id):
 @user_passes_test(is_staff_user, login_url='/access_denied/')
 def delete_forecast(request, forecast_id):
     if request.method == "POST":
-        forecast = next(
-            (forecast for forecast in FORECASTS if forecast["id"] == int(forecast_id)),
-            None,
-        )
-        FORECASTS.remove(forecast)
+        get_store().delete_forecast(forecast_id)
         return HttpResponseRedirect(reverse("index"))
 
 
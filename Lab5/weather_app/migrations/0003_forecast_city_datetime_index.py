@@ -0,0 +1,35 @@
+# Generated by Django 5.0.4 on 2026-10-16 21:05
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("weather_app", "0002_alter_city_name_alter_country_code_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="city",
+            name="name",
+            field=models.CharField(
+                db_index=True,
+                max_length=100,
+                validators=[
+                    django.core.validators.RegexValidator(
+                        code="invalid_name",
+                        message="Name must be Alphabetic",
+                        regex="^[a-zA-Z]*$",
+                    )
+                ],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="forecast",
+            index=models.Index(
+                fields=["city_id", "datetime"], name="forecast_city_datetime_idx"
+            ),
+        ),
+    ]
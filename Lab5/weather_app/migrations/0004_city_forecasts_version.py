@@ -0,0 +1,24 @@
+# Generated by Django 5.0.4 on 2026-10-16 23:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("weather_app", "0003_forecast_city_datetime_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="city",
+            name="forecasts_changed_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="city",
+            name="forecasts_version",
+            field=models.PositiveBigIntegerField(default=1),
+        ),
+    ]
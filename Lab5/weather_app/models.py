@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.core.validators import RegexValidator
 
 class Country(models.Model):
@@ -26,6 +27,7 @@ class Country(models.Model):
 class City(models.Model):
     name = models.CharField(
         max_length=100,
+        db_index=True,
         validators=[
             RegexValidator(
                 regex='^[a-zA-Z]*$',
@@ -35,9 +37,35 @@ class City(models.Model):
         ]
     )
     country_id = models.ForeignKey(Country, on_delete=models.CASCADE)
+    # Change counter of the city's forecasts, used to validate cached pages.
+    # Bumped in the same transaction as every forecast write, so all workers
+    # hand out and check the same validators.
+    forecasts_version = models.PositiveBigIntegerField(default=1)
+    forecasts_changed_at = models.DateTimeField(default=timezone.now)
+
+class ForecastQuerySet(models.QuerySet):
+    def for_city(self, city_id, date_from=None, date_to=None):
+        """Forecasts of a city in date order, both bounds inclusive.
+
+        Served from the (city_id, datetime) index, which already holds the
+        rows in the order they are returned.
+        """
+        forecasts = self.filter(city_id=city_id)
+        if date_from:
+            forecasts = forecasts.filter(datetime__gte=date_from)
+        if date_to:
+            forecasts = forecasts.filter(datetime__lte=date_to)
+        return forecasts.order_by("datetime")
 
 class Forecast(models.Model):
     city_id = models.ForeignKey(City, on_delete=models.CASCADE)
     datetime = models.DateField()
     forecasted_temperature = models.IntegerField()
-    forecasted_humidity = models.PositiveIntegerField()
\ No newline at end of file
+    forecasted_humidity = models.PositiveIntegerField()
+
+    objects = ForecastQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["city_id", "datetime"], name="forecast_city_datetime_idx"),
+        ]
\ No newline at end of file
@@ -1,3 +1,143 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .models import City, Country, Forecast
+
+
+@skipUnless(connection.vendor == "postgresql", "EXPLAIN output is Postgres specific")
+class ForecastQueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name="Ukraine", code="UA")
+        cities = City.objects.bulk_create(
+            City(name=f"City{chr(65 + i)}", country_id=country) for i in range(20)
+        )
+        start = date(2024, 1, 1)
+        Forecast.objects.bulk_create(
+            Forecast(
+                city_id=city,
+                datetime=start + timedelta(days=day),
+                forecasted_temperature=20,
+                forecasted_humidity=50,
+            )
+            for city in cities
+            for day in range(365)
+        )
+        cls.city = cities[0]
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE weather_app_forecast")
+            cursor.execute("ANALYZE weather_app_city")
+
+    def setUp(self):
+        # The tables are tiny, so keep the planner from preferring a full
+        # scan; what is checked is that a usable index exists.
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def test_date_range_uses_city_datetime_index(self):
+        forecasts = Forecast.objects.for_city(
+            self.city.id, date(2024, 3, 1), date(2024, 3, 31)
+        ).only("id", "datetime", "forecasted_temperature", "forecasted_humidity")
+        plan = forecasts.explain()
+        self.assertIn("forecast_city_datetime_idx", plan)
+        # The index already returns rows in date order.
+        self.assertNotIn("Sort", plan)
+        self.assertEqual(forecasts.count(), 31)
+
+    def test_city_name_lookup_uses_index(self):
+        plan = City.objects.filter(name=self.city.name).explain()
+        self.assertIn("Index", plan)
+        self.assertIn("weather_app_city_name", plan)
+
+
+# Pages are rendered without a collectstatic manifest.
+@override_settings(
+    STORAGES={
+        **settings.STORAGES,
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    }
+)
+class ForecastConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name="Ukraine", code="UA")
+        cls.kyiv, cls.lviv = City.objects.bulk_create(
+            City(name=name, country_id=country) for name in ("Kyiv", "Lviv")
+        )
+        cls.kyiv_forecasts = Forecast.objects.bulk_create(
+            Forecast(
+                city_id=cls.kyiv,
+                datetime=date(2024, 1, day),
+                forecasted_temperature=20,
+                forecasted_humidity=50,
+            )
+            for day in (1, 2)
+        )
+        cls.staff = User.objects.create_user(
+            "staff", password="password", is_staff=True
+        )
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def get(self, etag=None):
+        headers = {} if etag is None else {"if-none-match": etag}
+        return self.client.get(
+            reverse("get_forecast", args=["Kyiv"]), headers=headers
+        )
+
+    def create(self, city, day):
+        return self.client.post(reverse("create_forecast"), self.data(city, day))
+
+    def update(self, forecast, city, day):
+        return self.client.post(
+            reverse("update_forecast", args=[forecast.id]), self.data(city, day)
+        )
+
+    def delete(self, forecast):
+        return self.client.post(reverse("delete_forecast", args=[forecast.id]))
+
+    @staticmethod
+    def data(city, day):
+        return {
+            "city_id": city.id,
+            "forecast_datetime": f"2024-03-{day:02d}",
+            "forecasted_temperature": day,
+            "forecasted_humidity": 50,
+        }
+
+    def test_forecast_page_is_revalidated_until_its_city_changes(self):
+        page = self.get()
+        etag = page["ETag"]
+
+        self.assertEqual(page.status_code, 200)
+        self.assertIn("Last-Modified", page)
+        self.assertEqual(self.get(etag).status_code, 304)
+
+        # Changes to another city's forecasts leave the page's ETag alone.
+        self.assertEqual(self.create(self.lviv, 1).status_code, 302)
+        lviv_forecast = Forecast.objects.get(city_id=self.lviv)
+        self.assertEqual(self.update(lviv_forecast, self.lviv, 2).status_code, 302)
+        self.assertEqual(self.delete(lviv_forecast).status_code, 302)
+        self.assertEqual(self.get(etag).status_code, 304)
+
+        first, second = self.kyiv_forecasts
+        for change in (
+            lambda: self.create(self.kyiv, 3),
+            lambda: self.update(first, self.kyiv, 4),
+            lambda: self.delete(second),
+        ):
+            self.assertEqual(change().status_code, 302)
+            page = self.get(etag)
+            self.assertEqual(page.status_code, 200)
+            self.assertNotEqual(page["ETag"], etag)
+            etag = page["ETag"]
+            self.assertEqual(self.get(etag).status_code, 304)
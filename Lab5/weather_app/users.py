@@ -0,0 +1,43 @@
+import os
+
+from dotenv import load_dotenv
+
+
+def default_users():
+    load_dotenv()
+    return {
+        "superadmin": {
+            "email": os.getenv("SUPERADMIN_EMAIL"),
+            "password": os.getenv("SUPERADMIN_PASSWORD"),
+            "is_superuser": True,
+            "is_staff": True,
+        },
+        "user1": {
+            "email": "myemail@example.com",
+            "password": "password1",
+            "first_name": "John",
+            "last_name": "Doe",
+        },
+    }
+
+
+def create_default_users(using="default", **kwargs):
+    """Create the users the app ships with; return the usernames created.
+
+    Existing users are left alone, so once they exist this is a single query
+    and no password gets hashed.
+    """
+    from django.contrib.auth.models import User
+
+    users = default_users()
+    existing = set(
+        User.objects.using(using)
+        .filter(username__in=users)
+        .values_list("username", flat=True)
+    )
+    created = []
+    for username, fields in users.items():
+        if username not in existing:
+            User.objects.db_manager(using).create_user(username, **fields)
+            created.append(username)
+    return created
@@ -0,0 +1,49 @@
+import hashlib
+
+from django.db.models import F
+from django.db.models.functions import Now
+
+from .models import City
+
+
+def bump_forecast_versions(*city_ids):
+    """Record a change to the forecasts of `city_ids`.
+
+    Call it inside the write's transaction, so the change and its new
+    version are committed together.
+    """
+    City.objects.filter(pk__in=city_ids).update(
+        forecasts_version=F("forecasts_version") + 1, forecasts_changed_at=Now()
+    )
+
+
+def get_forecast_version(request, city_name):
+    # condition() asks for the ETag and the Last-Modified separately; one
+    # query answers both.
+    if not hasattr(request, "forecast_version"):
+        request.forecast_version = (
+            City.objects.filter(name=city_name)
+            .order_by("pk")
+            .values_list("pk", "forecasts_version", "forecasts_changed_at")
+            .first()
+        )
+    return request.forecast_version
+
+
+def forecast_etag(request, city_name):
+    version = get_forecast_version(request, city_name)
+    if version is None:
+        return None
+    city_id, number, changed_at = version
+    user = request.user
+    digest = hashlib.sha1(
+        repr(
+            (city_id, number, changed_at.isoformat(), user.pk, user.is_staff)
+        ).encode()
+    ).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+
+def forecast_last_modified(request, city_name):
+    version = get_forecast_version(request, city_name)
+    return None if version is None else version[2]
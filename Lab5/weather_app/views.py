@@ -2,39 +2,18 @@ from django.contrib.auth import logout, login, authenticate
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.http import HttpResponseRedirect, HttpResponseForbidden, HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from dotenv import load_dotenv
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
 from datetime import datetime
 from .models import Country, City, Forecast
+from .versions import bump_forecast_versions, forecast_etag, forecast_last_modified
 from django.core.exceptions import ValidationError
-import os
-
-
-def create_user():
-    user = User.objects.create_user("user1", "myemail@example.com", "password1")
-    user.first_name = "John"
-    user.last_name = "Doe"
-    user.save()
-
-
-def create_superadmin():
-    load_dotenv()
-    EMAIL = os.getenv("SUPERADMIN_EMAIL")
-    PASSWORD = os.getenv("SUPERADMIN_PASSWORD")
-    user = User.objects.create_user("superadmin", EMAIL, PASSWORD)
-    user.is_superuser = True
-    user.is_staff = True
-    user.save()
-
-
-try:
-    create_superadmin()
-    create_user()
-except Exception:
-    pass
 
 
 def index(request):
@@ -114,7 +93,9 @@ def create_forecast(request):
                 forecasted_humidity=forecasted_humidity,
             )
             forecast.full_clean()
-            forecast.save()
+            with transaction.atomic():
+                forecast.save()
+                bump_forecast_versions(city.id)
             return HttpResponseRedirect(reverse("index"))
         except ValidationError as e:
             return error_view(request, '400', str(e))
@@ -137,6 +118,9 @@ def add_country(request):
         return render(request, "add_country.html", {"user": request.user})
 
 @login_required
+@vary_on_cookie
+@cache_control(no_cache=True)
+@condition(etag_func=forecast_etag, last_modified_func=forecast_last_modified)
 def get_forecast(request, city_name):
     if request.method == "GET":
         city = City.objects.filter(name=city_name).first()
@@ -157,14 +141,9 @@ def get_forecast(request, city_name):
         except ValueError as e:
             return redirect('error_view', code="400", detail="Invalid datetime format")
 
-        if datetime_from and datetime_to:
-            forecasts = Forecast.objects.filter(city_id=city.id, datetime__range=[datetime_from, datetime_to])
-        elif datetime_from:
-            forecasts = Forecast.objects.filter(city_id=city.id, datetime__gte=datetime_from)
-        elif datetime_to:
-            forecasts = Forecast.objects.filter(city_id=city.id, datetime__lte=datetime_to)
-        else:
-            forecasts = Forecast.objects.filter(city_id=city.id)
+        forecasts = Forecast.objects.for_city(city.id, datetime_from, datetime_to).only(
+            "id", "datetime", "forecasted_temperature", "forecasted_humidity"
+        )
         return render(request, "forecasts.html", {"forecasts": forecasts, "cities": City.objects.all(), "user": request.user})
 
 @csrf_exempt
@@ -178,13 +157,16 @@ def update_forecast(request, forecast_id):
         forecasted_humidity = request.POST["forecasted_humidity"]
         city = City.objects.get(id=city_id)
         forecast = Forecast.objects.get(id=forecast_id)
+        previous_city_id = forecast.city_id_id
         forecast.city_id = city
         forecast.datetime = forecast_datetime
         forecast.forecasted_temperature = forecasted_temperature
         forecast.forecasted_humidity = forecasted_humidity
         try:
             forecast.full_clean()
-            forecast.save()
+            with transaction.atomic():
+                forecast.save()
+                bump_forecast_versions(previous_city_id, city.id)
             return HttpResponseRedirect(reverse("index"))
         except ValidationError as e:
             return error_view(request, '400', str(e))
@@ -194,7 +176,9 @@ def update_forecast(request, forecast_id):
 def delete_forecast(request, forecast_id):
     if request.method == "POST":
         forecast = Forecast.objects.get(id=forecast_id)
-        forecast.delete()
+        with transaction.atomic():
+            forecast.delete()
+            bump_forecast_versions(forecast.city_id_id)
         return HttpResponseRedirect(reverse("index"))
 
 def register(request):
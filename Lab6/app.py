@@ -1,23 +1,32 @@
-from flask import Flask, render_template, request, redirect, url_for, session, abort
+import os
+
+from flask import Flask, render_template, request, redirect, url_for, session, abort, make_response
+from flask_compress import Compress
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_migrate import Migrate
 
 from models import db, User, Country, City, Forecast
 from forms import LoginForm, RegisterForm, CityForm, CountryForm, ForecastForm, CSRFProtectForm, EditUserForm
+from static_assets import StaticAssets
+from versions import bump_forecast_versions, csrf_token_window, forecast_validators, register_forecast_versions, set_validators
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 from werkzeug.exceptions import BadRequest
+from werkzeug.http import is_resource_modified
 
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///lab6.db'  # Use your own database URI
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI') or 'sqlite:///lab6.db'  # Use your own database URI
 app.config['SECRET_KEY'] = 'qwertyquhjfbvsdgbh'
 
 db.init_app(app)
 migrate = Migrate(app, db)
+compress = Compress(app)
+static_assets = StaticAssets(app)
 
 with app.app_context():
     db.create_all()
+    register_forecast_versions()
     try:
         user = User(username='user', email='user@example.com')
         user.set_password('userpassword')
@@ -50,6 +59,8 @@ def create_forecast():
                             forecasted_humidity=form.forecasted_humidity.data)
         db.session.add(forecast)
         try:
+            db.session.flush()
+            bump_forecast_versions(forecast.city.name)
             db.session.commit()
             return redirect(url_for('index'))
         except IntegrityError:
@@ -104,6 +115,7 @@ def edit_forecast(forecast_id):
     if form.validate_on_submit():
         city_name = forecast.city.name
         form.populate_obj(forecast)
+        bump_forecast_versions(city_name, db.session.get(City, forecast.city_id).name)
         db.session.commit()
         return redirect(url_for('get_forecast', city_name=city_name))
     cities = City.query.all()
@@ -116,6 +128,12 @@ def edit_forecast(forecast_id):
 @app.route('/forecasts/city/<city_name>/', methods=['GET'])
 @login_required
 def get_forecast(city_name):
+    etag, last_modified = forecast_validators(
+        city_name, current_user.id, current_user.is_staff, csrf_token_window()
+    )
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return set_validators(make_response('', 304), etag, last_modified)
+
     city = City.query.filter_by(name=city_name).first()
     if city is None:
         return "Error: City not found"
@@ -133,12 +151,13 @@ def get_forecast(city_name):
     else:
         forecasts = Forecast.query.filter_by(city_id=city.id).all()
     form = ForecastForm()
-    return render_template('forecasts.html',
-                           forecasts=forecasts,
-                           city_name=city_name,
-                           forecast_datetime_from=datetime_from,
-                           forecast_datetime_to=datetime_to,
-                           form = form)
+    response = make_response(render_template('forecasts.html',
+                                             forecasts=forecasts,
+                                             city_name=city_name,
+                                             forecast_datetime_from=datetime_from,
+                                             forecast_datetime_to=datetime_to,
+                                             form = form))
+    return set_validators(response, etag, last_modified)
 
 @app.route('/forecasts/id/<int:forecast_id>/', methods=['GET', 'POST'])
 @login_required
@@ -146,10 +165,12 @@ def update_forecast(forecast_id):
     forecast = Forecast.query.get_or_404(forecast_id)
     form = ForecastForm(obj=forecast)
     if form.validate_on_submit():
+        previous_city_name = forecast.city.name
         form.populate_obj(forecast)
+        city_name = db.session.get(City, forecast.city_id).name
+        bump_forecast_versions(previous_city_name, city_name)
         db.session.commit()
-        city_name = forecast.city.name
-        return redirect(url_for('forecasts/city/<str:city_name>/', city_name=city_name))
+        return redirect(url_for('get_forecast', city_name=city_name))
     return render_template('edit_forecast.html', form=form)
 
 @app.route('/forecasts/<int:forecast_id>/delete/', methods=['POST'])
@@ -159,6 +180,7 @@ def delete_forecast(forecast_id):
     if forecast:
         city_name = forecast.city.name
         db.session.delete(forecast)
+        bump_forecast_versions(city_name)
         db.session.commit()
     return redirect(url_for('get_forecast', city_name=city_name))
 
@@ -295,6 +317,7 @@ def delete_city(city_id):
     city = City.query.get(city_id)
     if city:
         db.session.delete(city)
+        bump_forecast_versions(city.name)
         db.session.commit()
     return redirect(url_for('cities'))
 
@@ -308,7 +331,9 @@ def edit_city(city_id):
 
     form = CityForm(obj=city)
     if form.validate_on_submit():
+        city_name = city.name
         form.populate_obj(city)
+        bump_forecast_versions(city_name, city.name)
         db.session.commit()
         return redirect(url_for('cities'))
 
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# app.py creates its tables and example users on import, so the test
+# database is chosen before any test module imports it.
+os.environ["DATABASE_URI"] = f"sqlite:///{tempfile.mkdtemp()}/lab6.db"
@@ -30,6 +30,18 @@ class City(db.Model):
         return value
 
 
+class ForecastVersion(db.Model):
+    """Change counter of a city's forecasts, used to validate cached pages.
+
+    It lives in the database, bumped in the same transaction as the change,
+    so every worker hands out and checks the same validators.
+    """
+    __tablename__ = 'forecast_version'
+    city_name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False)
+
+
 class Forecast(db.Model):
     __tablename__ = 'forecast'
     id = db.Column(db.Integer, primary_key=True)
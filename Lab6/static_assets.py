@@ -0,0 +1,78 @@
+import gzip
+import hashlib
+import mimetypes
+from pathlib import Path
+
+from flask import Response, request
+
+GZIP_MINIMUM_SIZE = 500
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+)
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def fingerprint(name, body):
+    path = Path(name)
+    digest = hashlib.sha256(body).hexdigest()[:12]
+    return path.with_name(f"{path.stem}.{digest}{path.suffix}").as_posix()
+
+
+class StaticAssets:
+    """Fingerprints and pre-gzips the static folder when the app starts.
+
+    url_for('static', filename=...) resolves to the hashed name, which is
+    served from memory and cached forever because a new version of the file
+    gets a new name. Other names fall through to Flask's static view.
+    """
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.assets = {}
+        self.send_static_file = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        directory = Path(app.static_folder)
+        for path in sorted(directory.rglob("*")):
+            if not path.is_file():
+                continue
+            name = path.relative_to(directory).as_posix()
+            body = path.read_bytes()
+            mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            compressed = None
+            if mimetype.startswith(COMPRESSIBLE_TYPES) and len(body) >= GZIP_MINIMUM_SIZE:
+                compressed = gzip.compress(body, compresslevel=9, mtime=0)
+                if len(compressed) >= len(body):
+                    compressed = None
+            hashed_name = fingerprint(name, body)
+            self.manifest[name] = hashed_name
+            self.assets[hashed_name] = (body, compressed, mimetype)
+
+        app.url_defaults(self.hashed_url)
+        self.send_static_file = app.view_functions["static"]
+        app.view_functions["static"] = self.serve
+
+    def hashed_url(self, endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = self.manifest.get(values["filename"], values["filename"])
+
+    def serve(self, filename):
+        asset = self.assets.get(filename)
+        if asset is None:
+            return self.send_static_file(filename=filename)
+        body, compressed, mimetype = asset
+        response = Response(body, mimetype=mimetype)
+        if compressed is not None:
+            response.vary.add("Accept-Encoding")
+            if "gzip" in request.accept_encodings:
+                response.set_data(compressed)
+                response.content_encoding = "gzip"
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
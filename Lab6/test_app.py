@@ -0,0 +1,90 @@
+from datetime import date
+
+import pytest
+
+from app import app
+from models import City, Country, Forecast, ForecastVersion, db
+from versions import register_forecast_versions
+
+
+@pytest.fixture
+def client():
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        ForecastVersion.query.delete()
+        Forecast.query.delete()
+        City.query.delete()
+        Country.query.delete()
+        country = Country(name="Ukraine", code="UA")
+        db.session.add(country)
+        db.session.flush()
+        db.session.add_all(
+            [
+                City(id=1, name="Kyiv", country_id=country.id),
+                City(id=2, name="Lviv", country_id=country.id),
+            ]
+        )
+        db.session.add_all(
+            Forecast(
+                id=day,
+                city_id=1,
+                datetime=date(2024, 1, day),
+                forecasted_temperature=20,
+                forecasted_humidity=50,
+            )
+            for day in (1, 2)
+        )
+        db.session.commit()
+        register_forecast_versions()
+    client = app.test_client()
+    client.post(
+        "/accounts/login", data={"username": "admin", "password": "adminpassword"}
+    )
+    return client
+
+
+def forecast(city_id, day):
+    return {
+        "city_id": city_id,
+        "forecast_datetime": f"2024-03-{day:02d}",
+        "forecasted_temperature": day,
+        "forecasted_humidity": 50,
+    }
+
+
+def lviv_forecast_id():
+    with app.app_context():
+        return Forecast.query.filter_by(city_id=2).one().id
+
+
+def test_forecast_page_is_revalidated_until_its_city_changes(client):
+    def get(etag=None):
+        headers = {} if etag is None else {"If-None-Match": etag}
+        return client.get("/forecasts/city/Kyiv/", headers=headers)
+
+    page = get()
+    etag = page.headers["ETag"]
+
+    assert page.status_code == 200
+    assert "Last-Modified" in page.headers
+    assert get(etag).status_code == 304
+
+    # Changes to another city's forecasts leave the page's ETag alone.
+    assert client.post("/create_forecast", data=forecast(2, 1)).status_code == 302
+    assert (
+        client.post(f"/forecasts/id/{lviv_forecast_id()}/", data=forecast(2, 2))
+    ).status_code == 302
+    assert client.post(f"/forecasts/{lviv_forecast_id()}/delete/").status_code == 302
+    assert get(etag).status_code == 304
+
+    for change in (
+        lambda: client.post("/create_forecast", data=forecast(1, 3)),
+        lambda: client.post("/forecasts/id/1/", data=forecast(1, 4)),
+        lambda: client.post("/forecasts/2/delete/"),
+    ):
+        assert change().status_code == 302
+        page = get(etag)
+        assert page.status_code == 200
+        assert page.headers["ETag"] != etag
+        etag = page.headers["ETag"]
+        assert get(etag).status_code == 304
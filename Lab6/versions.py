@@ -0,0 +1,90 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import literal, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import City, ForecastVersion, db
+
+
+# Both backends support INSERT ... ON CONFLICT through their own insert().
+UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def bump_forecast_versions(*city_names):
+    """Record a change to the forecasts of `city_names` in the current transaction."""
+    changed_at = _utcnow()
+    upsert = UPSERTS[db.engine.dialect.name](ForecastVersion).values(
+        [
+            {"city_name": name, "version": 1, "changed_at": changed_at}
+            for name in set(city_names)
+        ]
+    )
+    db.session.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[ForecastVersion.city_name],
+            set_={
+                "version": ForecastVersion.version + 1,
+                "changed_at": upsert.excluded.changed_at,
+            },
+        )
+    )
+
+
+def register_forecast_versions():
+    # Cities never changed through the app get a first version, so their
+    # pages can be validated too. SQLite needs a WHERE clause to tell
+    # ON CONFLICT apart from a join constraint after INSERT ... SELECT.
+    db.session.execute(
+        UPSERTS[db.engine.dialect.name](ForecastVersion)
+        .from_select(
+            ["city_name", "version", "changed_at"],
+            select(City.name, literal(1), literal(_utcnow())).where(text("true")),
+        )
+        .on_conflict_do_nothing()
+    )
+    db.session.commit()
+
+
+def forecast_validators(city_name, *variant):
+    """ETag and Last-Modified for the forecast page of `city_name`, varying on `variant`.
+
+    Without a stored version there is nothing to validate against, so both
+    are None and the page is always sent in full.
+    """
+    version = db.session.execute(
+        select(ForecastVersion.version, ForecastVersion.changed_at).where(
+            ForecastVersion.city_name == city_name
+        )
+    ).first()
+    if version is None:
+        return None, None
+    number, changed_at = version
+    changed_at = changed_at.replace(tzinfo=timezone.utc)
+    # The change time tells apart versions of a database that was recreated.
+    digest = hashlib.sha1(
+        repr((city_name, number, changed_at.isoformat(), variant)).encode()
+    ).hexdigest()
+    return digest[:20], changed_at
+
+
+def csrf_token_window():
+    # Pages embed a Flask-WTF CSRF token, so a cached copy has to be replaced
+    # well before that token expires.
+    time_limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    return int(time.time() // (time_limit / 2)) if time_limit else None
+
+
+def set_validators(response, etag, last_modified):
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.vary.add("Cookie")
+    return response
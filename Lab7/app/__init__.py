@@ -1,12 +1,17 @@
 from flask import Flask, redirect, url_for
+from flask_compress import Compress
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 
 from .models import db, User
+from .static_assets import StaticAssets
+from .versions import register_forecast_versions
 
 login_manager = LoginManager()
 login_manager.login_view = "main.login_view"
+compress = Compress()
+static_assets = StaticAssets()
 
 
 def create_app(config_name="development"):
@@ -16,9 +21,12 @@ def create_app(config_name="development"):
     db.init_app(app)
     Migrate(app, db)
     login_manager.init_app(app)
+    compress.init_app(app)
+    static_assets.init_app(app)
 
     with app.app_context():
         db.create_all()
+        register_forecast_versions()
 
         # Example user creation
         try:
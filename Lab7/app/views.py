@@ -1,11 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, abort, flash
+from flask import Blueprint, render_template, request, redirect, url_for, session, abort, make_response, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import BadRequest
+from werkzeug.http import is_resource_modified
 
 from . import login_manager
 from .models import db, User, Country, City, Forecast
 from .forms import LoginForm, RegisterForm, CityForm, CountryForm, ForecastForm, CSRFProtectForm, EditUserForm
+from .versions import bump_forecast_versions, csrf_token_window, forecast_validators, set_validators
 
 main = Blueprint('main', __name__)
 
@@ -24,6 +26,8 @@ def create_forecast():
                             forecasted_humidity=form.forecasted_humidity.data)
         db.session.add(forecast)
         try:
+            db.session.flush()
+            bump_forecast_versions(forecast.city.name)
             db.session.commit()
             return redirect(url_for('main.index'))
         except IntegrityError:
@@ -76,6 +80,7 @@ def edit_forecast(forecast_id):
     if form.validate_on_submit():
         city_name = forecast.city.name
         form.populate_obj(forecast)
+        bump_forecast_versions(city_name, db.session.get(City, forecast.city_id).name)
         db.session.commit()
         return redirect(url_for('main.get_forecast', city_name=city_name))
     cities = City.query.all()
@@ -84,6 +89,12 @@ def edit_forecast(forecast_id):
 @main.route('/forecasts/city/<city_name>/', methods=['GET'])
 @login_required
 def get_forecast(city_name):
+    etag, last_modified = forecast_validators(
+        city_name, current_user.id, current_user.is_staff, csrf_token_window()
+    )
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return set_validators(make_response('', 304), etag, last_modified)
+
     city = City.query.filter_by(name=city_name).first()
     if city is None:
         return "Error: City not found"
@@ -101,8 +112,9 @@ def get_forecast(city_name):
     else:
         forecasts = Forecast.query.filter_by(city_id=city.id).all()
     form = ForecastForm()
-    return render_template('forecasts.html', forecasts=forecasts, city_name=city_name,
-                           forecast_datetime_from=datetime_from, forecast_datetime_to=datetime_to, form=form)
+    response = make_response(render_template('forecasts.html', forecasts=forecasts, city_name=city_name,
+                                             forecast_datetime_from=datetime_from, forecast_datetime_to=datetime_to, form=form))
+    return set_validators(response, etag, last_modified)
 
 @main.route('/forecasts/id/<int:forecast_id>/', methods=['GET', 'POST'])
 @login_required
@@ -110,9 +122,11 @@ def update_forecast(forecast_id):
     forecast = Forecast.query.get_or_404(forecast_id)
     form = ForecastForm(obj=forecast)
     if form.validate_on_submit():
+        previous_city_name = forecast.city.name
         form.populate_obj(forecast)
+        city_name = db.session.get(City, forecast.city_id).name
+        bump_forecast_versions(previous_city_name, city_name)
         db.session.commit()
-        city_name = forecast.city.name
         return redirect(url_for('main.get_forecast', city_name=city_name))
     return render_template('edit_forecast.html', form=form)
 
@@ -123,6 +137,7 @@ def delete_forecast(forecast_id):
     if forecast:
         city_name = forecast.city.name
         db.session.delete(forecast)
+        bump_forecast_versions(city_name)
         db.session.commit()
     return redirect(url_for('main.get_forecast', city_name=city_name))
 
@@ -244,6 +259,7 @@ def delete_city(city_id):
     city = City.query.get(city_id)
     if city:
         db.session.delete(city)
+        bump_forecast_versions(city.name)
         db.session.commit()
     return redirect(url_for('main.cities'))
 
@@ -255,7 +271,9 @@ def edit_city(city_id):
         return redirect(url_for('main.error_view', code=404, detail='City not found'))
     form = CityForm(obj=city)
     if form.validate_on_submit():
+        city_name = city.name
         form.populate_obj(city)
+        bump_forecast_versions(city_name, city.name)
         db.session.commit()
         return redirect(url_for('main.cities'))
     countries = Country.query.all()
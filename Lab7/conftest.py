@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# config.py reads the database URI on import, so the test database is
+# chosen before any test module imports it.
+os.environ["TESTING_DATABASE_URI"] = f"sqlite:///{tempfile.mkdtemp()}/testing.db"
@@ -0,0 +1,123 @@
+"""Forecast search throughput under a concurrent writer, default vs tuned SQLite.
+
+Usage: python benchmark.py [--readers 8] [--seconds 5] [--forecasts 100000]
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models import SQLITE_PRAGMAS
+
+SEARCH_QUERY = """
+    SELECT forecasts.* FROM forecasts
+    JOIN cities ON cities.id = forecasts.city_id
+    WHERE cities.name = ? AND forecasts.datetime >= ? AND forecasts.datetime <= ?
+    ORDER BY forecasts.datetime
+"""
+
+PROFILES = {
+    "default": {"foreign_keys": "ON"},
+    "tuned": SQLITE_PRAGMAS,
+}
+
+
+def connect(path, pragmas):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    for name, value in pragmas.items():
+        conn.execute(f"pragma {name}={value}")
+    return conn
+
+
+def seed(path, pragmas, forecasts):
+    conn = connect(path, pragmas)
+    conn.executescript(
+        """
+            CREATE TABLE countries (id INTEGER PRIMARY KEY, name VARCHAR, code VARCHAR);
+            CREATE TABLE cities (
+                id INTEGER PRIMARY KEY, name VARCHAR UNIQUE,
+                country_id INTEGER REFERENCES countries(id)
+            );
+            CREATE TABLE forecasts (
+                id INTEGER PRIMARY KEY, city_id INTEGER REFERENCES cities(id),
+                datetime DATETIME, forecasted_temperature FLOAT,
+                forecasted_humidity FLOAT
+            );
+            INSERT INTO countries VALUES (1, 'ukraine', 'ua');
+        """
+    )
+    conn.executemany(
+        "INSERT INTO cities VALUES (?, ?, 1)",
+        [(i, f"city{i}") for i in range(1, 101)],
+    )
+    start = datetime(2024, 1, 1)
+    conn.executemany(
+        "INSERT INTO forecasts (city_id, datetime, forecasted_temperature, forecasted_humidity) "
+        "VALUES (?, ?, 20, 50)",
+        (
+            (i % 100 + 1, str(start + timedelta(minutes=i)))
+            for i in range(forecasts)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(path, pragmas, readers, seconds):
+    stop = threading.Event()
+    counts = {"reads": 0, "writes": 0}
+    lock = threading.Lock()
+
+    def reader(number):
+        conn = connect(path, pragmas)
+        reads = 0
+        while not stop.is_set():
+            conn.execute(
+                SEARCH_QUERY,
+                (f"city{number % 100 + 1}", "2024-01-01", "2024-01-02"),
+            ).fetchall()
+            reads += 1
+        with lock:
+            counts["reads"] += reads
+
+    def writer():
+        conn = connect(path, pragmas)
+        writes = 0
+        while not stop.is_set():
+            conn.execute(
+                "INSERT INTO forecasts (city_id, datetime, forecasted_temperature, forecasted_humidity) "
+                "VALUES (1, ?, 20, 50)",
+                (str(datetime.now()),),
+            )
+            conn.commit()
+            writes += 1
+        counts["writes"] = writes
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return counts["reads"] / seconds, counts["writes"] / seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--forecasts", type=int, default=100_000)
+    args = parser.parse_args()
+
+    for name, pragmas in PROFILES.items():
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "benchmark.db")
+            seed(path, pragmas, args.forecasts)
+            reads, writes = run(path, pragmas, args.readers, args.seconds)
+            print(f"{name:>8}: {reads:10.0f} reads/s {writes:10.0f} writes/s")
@@ -0,0 +1,10 @@
+import os
+import tempfile
+from pathlib import Path
+
+# main.py finds "static" and "templates" relative to the working directory,
+# as it does when the app is started from lab1/.
+os.chdir(Path(__file__).parent)
+# models.py creates its engines on import, so the test database is chosen
+# before any test module imports it.
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/sqlite.db"
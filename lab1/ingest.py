@@ -0,0 +1,153 @@
+import csv
+import time
+from collections.abc import AsyncIterable
+
+import orjson
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import City, Forecast, ReadSessionLocal, bump_forecast_versions
+from schemas import ForecastSchema
+
+INGEST_BATCH_SIZE = 10_000
+MAX_REPORTED_ERRORS = 1000
+
+CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+
+async def read_lines(chunks: AsyncIterable[bytes]):
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+async def read_records(chunks: AsyncIterable[bytes], file_format: str):
+    """Yield (line number, record, error) for every non-empty line."""
+    header = None
+    number = 0
+    async for line in read_lines(chunks):
+        number += 1
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if file_format == "csv":
+                values = next(csv.reader([line.decode()]))
+                if header is None:
+                    header = values
+                    continue
+                if len(values) != len(header):
+                    raise ValueError(
+                        f"Expected {len(header)} columns, got {len(values)}"
+                    )
+                record = dict(zip(header, values))
+            else:
+                record = orjson.loads(line)
+        except (csv.Error, ValueError) as e:
+            yield number, None, str(e)
+            continue
+        yield number, record, None
+
+
+def format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(map(str, detail['loc'])) or 'row'}: {detail['msg']}"
+        for detail in error.errors(include_url=False)
+    )
+
+
+async def insert_forecasts(
+    db: AsyncSession, forecasts: list[dict], city_names: dict[int, str]
+):
+    # One executemany per batch, committed on its own so the single SQLite
+    # writer is never held for the whole upload.
+    await db.execute(insert(Forecast), forecasts)
+    await bump_forecast_versions(
+        db, {city_names[forecast["city_id"]] for forecast in forecasts}
+    )
+    await db.commit()
+
+
+async def ingest_forecasts(
+    db: AsyncSession,
+    chunks: AsyncIterable[bytes],
+    file_format: str,
+    batch_size: int = INGEST_BATCH_SIZE,
+):
+    started = time.perf_counter()
+    # Loaded through a read session that is closed before the body is read,
+    # so a slow upload holds no connection until its first batch is ready.
+    # On SQLite, `db` is the only writer connection and every other write
+    # would wait for it.
+    async with ReadSessionLocal() as read_db:
+        city_names = dict((await read_db.execute(select(City.id, City.name))).all())
+    inserted = 0
+    errors = []
+    rejected = 0
+    batch = []
+    batch_lines = []
+
+    async def flush():
+        # A batch the database refuses, e.g. for a city deleted during the
+        # upload or a lock that timed out, is rejected as a whole and the
+        # upload goes on with the next one.
+        nonlocal inserted, rejected
+        try:
+            await insert_forecasts(db, batch, city_names)
+        except (IntegrityError, OperationalError) as e:
+            await db.rollback()
+            rejected += len(batch)
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(
+                    {
+                        "line": batch_lines[0],
+                        "last_line": batch_lines[-1],
+                        "error": f"Batch not inserted: {e.orig}",
+                    }
+                )
+        else:
+            inserted += len(batch)
+
+    async for number, record, error in read_records(chunks, file_format):
+        if error is None:
+            try:
+                forecast = ForecastSchema.model_validate(record)
+            except ValidationError as e:
+                error = format_validation_error(e)
+            else:
+                if forecast.city_id not in city_names:
+                    error = f"City {forecast.city_id} not found"
+        if error is not None:
+            rejected += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"line": number, "error": error})
+            continue
+        batch.append(forecast.model_dump())
+        batch_lines.append(number)
+        if len(batch) >= batch_size:
+            await flush()
+            batch = []
+            batch_lines = []
+    if batch:
+        await flush()
+
+    seconds = time.perf_counter() - started
+    return {
+        "inserted": inserted,
+        "rejected": rejected,
+        "errors": errors,
+        "seconds": seconds,
+        "rows_per_second": inserted / seconds if seconds else 0.0,
+    }
@@ -1,16 +1,28 @@
+import base64
+import binascii
 from datetime import datetime
 from typing import Annotated
 
+import orjson
+
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request, HTTPException, Depends, status, Form
+from fastapi import FastAPI, Request, HTTPException, Depends, status, Form, Query
+from fastapi.exception_handlers import (
+    http_exception_handler as default_http_exception_handler,
+)
 from fastapi.exceptions import HTTPException as StarletteHTTPException
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import (
+    HTMLResponse,
+    ORJSONResponse,
+    RedirectResponse,
+    Response,
+)
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from sqlalchemy import select, insert, update, delete
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from authorization import (
     authenticate_user,
@@ -19,29 +31,66 @@ from authorization import (
     create_superadmin,
     get_superadmin,
     get_current_user,
+    password_hasher,
 )
+from ingest import CONTENT_TYPES, ingest_forecasts
 from models import (
     SessionLocal,
     engine,
     get_db,
+    get_read_db,
+    read_engine,
     User,
     Forecast,
     Base,
     City,
+    bump_forecast_versions,
+    create_missing_forecast_versions,
+    create_missing_indexes,
+    get_forecast_version,
+    select_forecast_page,
+    select_forecasts,
 )
+from static_assets import GZIP_MINIMUM_SIZE, PrecompressedStaticFiles
+from versions import is_not_modified, page_headers
 from schemas import (
+    ForecastPageSchema,
     ForecastSchema,
+    IngestReportSchema,
 )
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
-async def startup_event():
-    Base.metadata.create_all(bind=engine)
-    db = SessionLocal()
+
+def encode_cursor(forecast_datetime: datetime, forecast_id: int) -> str:
+    cursor = orjson.dumps([forecast_datetime, forecast_id])
+    return base64.urlsafe_b64encode(cursor).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
     try:
-        create_superadmin(db)
-        create_example_user(db)
-    finally:
-        db.close()
+        forecast_datetime, forecast_id = orjson.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(forecast_datetime), int(forecast_id)
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+async def startup_event():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_missing_indexes)
+        await conn.run_sync(create_missing_forecast_versions)
+    async with SessionLocal() as db:
+        await create_superadmin(db)
+        await create_example_user(db)
+
+
+async def shutdown_event():
+    await engine.dispose()
+    await read_engine.dispose()
 
 
 app = FastAPI(
@@ -55,8 +104,12 @@ app = FastAPI(
 )
 
 app.add_event_handler("startup", startup_event)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.add_event_handler("shutdown", shutdown_event)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+static_files = PrecompressedStaticFiles(directory="static")
+app.mount("/static", static_files, name="static")
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["static_url"] = static_files.url
 
 
 @app.exception_handler(StarletteHTTPException)
@@ -64,6 +117,8 @@ async def http_exception_handler(
     request: Request,
     exc: HTTPException,
 ):
+    if request.url.path.startswith("/api/"):
+        return await default_http_exception_handler(request, exc)
     return templates.TemplateResponse(
         name="error.html",
         request=request,
@@ -72,19 +127,21 @@ async def http_exception_handler(
 
 
 @app.get("/", tags=["Forecasts"], response_class=HTMLResponse)
-def index(request: Request, user: Annotated[User | None, Depends(get_current_user)]):
+async def index(
+    request: Request, user: Annotated[User | None, Depends(get_current_user)]
+):
     return templates.TemplateResponse(
         name="index.html", request=request, context={"user": user}
     )
 
 
 @app.get("/create-forecast", tags=["Forecasts"], response_class=HTMLResponse)
-def create_forecast(
+async def create_forecast(
     request: Request,
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_read_db)],
     user: Annotated[User, Depends(get_superadmin)],
 ):
-    cities = db.scalars(select(City)).all()
+    cities = (await db.scalars(select(City))).all()
     return templates.TemplateResponse(
         name="create_forecast.html",
         request=request,
@@ -95,13 +152,13 @@ def create_forecast(
 @app.get(
     "/edit-forecast/{forecast_id}", tags=["Forecasts"], response_class=HTMLResponse
 )
-def edit_forecast(
+async def edit_forecast(
     request: Request,
     forecast_id: int,
     user: Annotated[User, Depends(get_superadmin)],
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_read_db)],
 ):
-    forecast = db.scalar(select(Forecast).where(Forecast.id == forecast_id))
+    forecast = await db.scalar(select(Forecast).where(Forecast.id == forecast_id))
     return templates.TemplateResponse(
         name="edit_forecast.html",
         request=request,
@@ -121,14 +178,15 @@ async def create_forecast(
     forecast_datetime: Annotated[datetime, Form()],
     forecasted_temperature: Annotated[int, Form()],
     forecasted_humidity: Annotated[int, Form()],
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_db)],
     user: Annotated[User, Depends(get_superadmin)],
 ):
-    if db.scalar(select(City).where(City.id == city_id)) is None:
+    city = await db.scalar(select(City).where(City.id == city_id))
+    if city is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="City not found"
         )
-    forecast = db.scalar(
+    forecast = await db.scalar(
         insert(Forecast)
         .values(
             city_id=city_id,
@@ -138,8 +196,9 @@ async def create_forecast(
         )
         .returning(Forecast)
     )
-    db.commit()
-    db.refresh(forecast)
+    await bump_forecast_versions(db, [city.name])
+    await db.commit()
+    await db.refresh(forecast)
     return templates.TemplateResponse(
         name="message.html",
         request=request,
@@ -148,21 +207,25 @@ async def create_forecast(
 
 
 @app.get("/forecasts", tags=["Forecasts"], response_class=HTMLResponse)
-def get_forecast(
+async def get_forecast(
     request: Request,
     city_name: str,
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_read_db)],
     user: Annotated[User, Depends(get_current_user)],
     forecast_datetime_from: datetime | None = None,
     forecast_datetime_to: datetime | None = None,
 ):
-    forecasts = db.scalars(
-        select(Forecast)
-        .join(City, City.id == Forecast.city_id)
-        .where(City.name == city_name.lower())
-        .where(Forecast.datetime <= (forecast_datetime_to or datetime.max))
-        .where(Forecast.datetime >= (forecast_datetime_from or datetime.min))
-        .order_by(Forecast.datetime)
+    headers = page_headers(
+        await get_forecast_version(db, city_name),
+        city_name.lower(),
+        user.username if user else None,
+    )
+    if is_not_modified(request, headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    forecasts = (
+        await db.scalars(
+            select_forecasts(city_name, forecast_datetime_from, forecast_datetime_to)
+        )
     ).all()
     if len(forecasts) == 0:
         raise HTTPException(
@@ -178,9 +241,71 @@ def get_forecast(
             "forecast_datetime_to": forecast_datetime_to,
             "forecasts": forecasts,
         },
+        headers=headers,
+    )
+
+
+# Same access rules as the HTML search it serves dashboards in place of:
+# anonymous requests are answered, an invalid token is rejected.
+@app.get(
+    "/api/v1/forecasts",
+    tags=["Forecasts"],
+    response_model=ForecastPageSchema,
+    response_class=ORJSONResponse,
+    dependencies=[Depends(get_current_user)],
+)
+async def get_forecast_page(
+    city_name: str,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    forecast_datetime_from: datetime | None = None,
+    forecast_datetime_to: datetime | None = None,
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+):
+    after = decode_cursor(cursor) if cursor is not None else None
+    rows = (
+        await db.execute(
+            select_forecast_page(
+                city_name,
+                limit,
+                forecast_datetime_from,
+                forecast_datetime_to,
+                after,
+            )
+        )
+    ).mappings().all()
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(items[-1]["datetime"], items[-1]["id"])
+    # Rows come straight from the database, so they are serialized as they
+    # are instead of being validated against ForecastPageSchema again.
+    return ORJSONResponse(
+        {"items": [dict(item) for item in items], "next_cursor": next_cursor}
     )
 
 
+@app.post(
+    "/api/v1/forecasts/bulk",
+    tags=["Forecasts"],
+    response_model=IngestReportSchema,
+    response_class=ORJSONResponse,
+)
+async def ingest_forecast_file(
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_db)],
+    user: Annotated[User, Depends(get_superadmin)],
+):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    file_format = CONTENT_TYPES.get(content_type)
+    if file_format is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Expected one of: {', '.join(CONTENT_TYPES)}",
+        )
+    return ORJSONResponse(await ingest_forecasts(db, request.stream(), file_format))
+
+
 @app.post(
     "/forecasts/{forecast_id}",
     tags=["Forecasts"],
@@ -194,21 +319,25 @@ async def update_forecast(
     forecast_datetime: Annotated[datetime, Form()],
     forecasted_temperature: Annotated[int, Form()],
     forecasted_humidity: Annotated[int, Form()],
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_db)],
     user: Annotated[User, Depends(get_superadmin)],
 ):
-    db_forecast = db.scalar(select(Forecast).where(Forecast.id == forecast_id))
+    db_forecast = await db.scalar(select(Forecast).where(Forecast.id == forecast_id))
 
     if db_forecast is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Forecast not found"
         )
 
-    if db.scalar(select(City).where(City.id == city_id)) is None:
+    city = await db.scalar(select(City).where(City.id == city_id))
+    if city is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="City not found"
         )
-    db.execute(
+    previous_city_name = await db.scalar(
+        select(City.name).where(City.id == db_forecast.city_id)
+    )
+    await db.execute(
         update(Forecast)
         .where(Forecast.id == forecast_id)
         .values(
@@ -218,8 +347,9 @@ async def update_forecast(
             forecasted_humidity=forecasted_humidity,
         )
     )
-    db.commit()
-    db.refresh(db_forecast)
+    await bump_forecast_versions(db, [previous_city_name, city.name])
+    await db.commit()
+    await db.refresh(db_forecast)
 
     return templates.TemplateResponse(
         name="message.html",
@@ -231,20 +361,23 @@ async def update_forecast(
 @app.delete(
     "/forecasts/{forecast_id}", tags=["Forecasts"], response_model=ForecastSchema
 )
-def delete_forecast(
+async def delete_forecast(
     request: Request,
     forecast_id: int,
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_db)],
     user: Annotated[User, Depends(get_superadmin)],
 ):
-    forecast = db.scalar(
+    forecast = await db.scalar(
         delete(Forecast).where(Forecast.id == forecast_id).returning(Forecast)
     )
-    db.commit()
     if forecast is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Forecast not found"
         )
+    await bump_forecast_versions(
+        db, [await db.scalar(select(City.name).where(City.id == forecast.city_id))]
+    )
+    await db.commit()
     return templates.TemplateResponse(
         name="message.html",
         request=request,
@@ -252,6 +385,11 @@ def delete_forecast(
     )
 
 
+@app.get("/password-hasher-stats", tags=["Monitoring"])
+async def password_hasher_stats(user: Annotated[User, Depends(get_superadmin)]):
+    return password_hasher.get_stats()
+
+
 @app.get("/login", tags=["Authorization"], response_class=HTMLResponse)
 async def login(request: Request):
     return templates.TemplateResponse(
@@ -270,9 +408,9 @@ async def logout():
 @app.post("/token", tags=["Authorization"], response_class=RedirectResponse)
 async def get_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_read_db)],
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
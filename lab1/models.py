@@ -1,69 +1,281 @@
-from datetime import datetime
-
-from sqlalchemy import create_engine, ForeignKey
-from sqlalchemy import event
-from sqlalchemy.orm import (
-    sessionmaker,
-    Mapped,
-    mapped_column,
-    DeclarativeBase,
-    MappedAsDataclass,
-)
-
-
-def _fk_pragma_on_connect(dbapi_con, _con_record):
-    dbapi_con.execute("pragma foreign_keys=ON")
-
-
-DATABASE_URL = "sqlite:///./sqlite.db"
-
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-event.listen(engine, "connect", _fk_pragma_on_connect)
-SessionLocal = sessionmaker(engine, autoflush=False)
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-class Base(MappedAsDataclass, DeclarativeBase):
-    pass
-
-
-class User(Base):
-    __tablename__ = "users"
-
-    id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    username: Mapped[str] = mapped_column(unique=True, index=True)
-    email: Mapped[str] = mapped_column(unique=True, index=True)
-    hashed_password: Mapped[str]
-    role: Mapped[str] = mapped_column(default="user")
-
-
-class Country(Base):
-    __tablename__ = "countries"
-
-    id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    name: Mapped[str] = mapped_column(unique=True)
-    code: Mapped[str] = mapped_column(unique=True)
-
-
-class City(Base):
-    __tablename__ = "cities"
-    id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str] = mapped_column(unique=True)
-    country_id: Mapped[int] = mapped_column(ForeignKey("countries.id"))
-
-
-class Forecast(Base):
-    __tablename__ = "forecasts"
-
-    id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    city_id: Mapped[int] = mapped_column(ForeignKey("cities.id"))
-    datetime: Mapped[datetime]
-    forecasted_temperature: Mapped[float]
-    forecasted_humidity: Mapped[float]
+import os
+from datetime import datetime, timezone
+
+from sqlalchemy import ForeignKey, Index, func, literal, make_url, select, text, tuple_
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import (
+    Mapped,
+    mapped_column,
+    DeclarativeBase,
+    MappedAsDataclass,
+)
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+SQLITE_PRAGMAS = {
+    "foreign_keys": "ON",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)),
+    "cache_size": -64 * 1024,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", 8))
+
+
+def _sqlite_pragmas_on_connect(dbapi_con, _con_record):
+    cursor = dbapi_con.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"pragma {name}={value}")
+    cursor.close()
+
+
+def _read_only_pragma_on_connect(dbapi_con, _con_record):
+    cursor = dbapi_con.cursor()
+    cursor.execute("pragma query_only=ON")
+    cursor.close()
+
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def get_async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def create_sqlite_engine(url, pool_size: int, read_only: bool = False):
+    sqlite_engine = create_async_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+    )
+    event.listen(sqlite_engine.sync_engine, "connect", _sqlite_pragmas_on_connect)
+    if read_only:
+        event.listen(
+            sqlite_engine.sync_engine, "connect", _read_only_pragma_on_connect
+        )
+    return sqlite_engine
+
+
+DATABASE_URL = get_async_url(os.getenv("DATABASE_URL", "sqlite:///./sqlite.db"))
+
+if DATABASE_URL.get_backend_name() == "sqlite":
+    # SQLite allows one writer at a time, so writes are serialized through a
+    # single connection while WAL lets the read-only pool run alongside it.
+    engine = create_sqlite_engine(DATABASE_URL, pool_size=1)
+    read_engine = create_sqlite_engine(
+        DATABASE_URL, pool_size=SQLITE_READ_POOL_SIZE, read_only=True
+    )
+else:
+    engine = create_async_engine(DATABASE_URL)
+    read_engine = engine
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(
+    read_engine, autoflush=False, expire_on_commit=False
+)
+
+
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+
+async def get_read_db():
+    async with ReadSessionLocal() as db:
+        yield db
+
+
+class Base(MappedAsDataclass, DeclarativeBase):
+    pass
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    username: Mapped[str] = mapped_column(unique=True, index=True)
+    email: Mapped[str] = mapped_column(unique=True, index=True)
+    hashed_password: Mapped[str]
+    role: Mapped[str] = mapped_column(default="user")
+
+
+class Country(Base):
+    __tablename__ = "countries"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    name: Mapped[str] = mapped_column(unique=True)
+    code: Mapped[str] = mapped_column(unique=True)
+
+
+class City(Base):
+    __tablename__ = "cities"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(unique=True)
+    country_id: Mapped[int] = mapped_column(ForeignKey("countries.id"))
+
+
+class Forecast(Base):
+    __tablename__ = "forecasts"
+    __table_args__ = (
+        # Covers the forecast search: rows come out already ordered by
+        # (datetime, id) and the table itself is never read.
+        Index(
+            "ix_forecasts_city_id_datetime_id",
+            "city_id",
+            "datetime",
+            "id",
+            "forecasted_temperature",
+            "forecasted_humidity",
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    city_id: Mapped[int] = mapped_column(ForeignKey("cities.id"))
+    datetime: Mapped[datetime]
+    forecasted_temperature: Mapped[float]
+    forecasted_humidity: Mapped[float]
+
+
+class ForecastVersion(Base):
+    """Change counter of a city's forecasts, used to validate cached pages.
+
+    It lives in the database, bumped in the same transaction as the change,
+    so every worker hands out and checks the same validators.
+    """
+
+    __tablename__ = "forecast_versions"
+
+    city_name: Mapped[str] = mapped_column(primary_key=True)
+    version: Mapped[int]
+    changed_at: Mapped[datetime]
+
+
+# Both backends support INSERT ... ON CONFLICT through their own insert().
+UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def bump_forecast_versions(db, city_names):
+    """Record a change to the forecasts of `city_names` in the current transaction."""
+    city_names = {name.lower() for name in city_names}
+    if not city_names:
+        return
+    changed_at = _utcnow()
+    upsert = UPSERTS[db.bind.dialect.name](ForecastVersion).values(
+        [
+            {"city_name": name, "version": 1, "changed_at": changed_at}
+            for name in city_names
+        ]
+    )
+    await db.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[ForecastVersion.city_name],
+            set_={
+                "version": ForecastVersion.version + 1,
+                "changed_at": upsert.excluded.changed_at,
+            },
+        )
+    )
+
+
+def create_missing_forecast_versions(conn):
+    # Cities that were never changed through the app get a first version, so
+    # their pages can be validated too. SQLite needs a WHERE clause to tell
+    # ON CONFLICT apart from a join constraint after INSERT ... SELECT.
+    conn.execute(
+        UPSERTS[conn.dialect.name](ForecastVersion)
+        .from_select(
+            ["city_name", "version", "changed_at"],
+            select(func.lower(City.name), literal(1), literal(_utcnow())).where(
+                text("true")
+            ),
+        )
+        .on_conflict_do_nothing()
+    )
+
+
+async def get_forecast_version(db, city_name: str):
+    return (
+        await db.execute(
+            select(ForecastVersion.version, ForecastVersion.changed_at).where(
+                ForecastVersion.city_name == city_name.lower()
+            )
+        )
+    ).first()
+
+
+# Indexes replaced by a differently named one. Indexes are matched by name
+# only, so a changed definition has to come under a new name.
+OBSOLETE_INDEXES = ["ix_forecasts_city_id_datetime"]
+
+
+def create_missing_indexes(conn):
+    # create_all skips tables that already exist, indexes included.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    for name in OBSOLETE_INDEXES:
+        conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+
+
+def _filter_forecasts(
+    query,
+    city_name: str,
+    datetime_from: datetime | None,
+    datetime_to: datetime | None,
+):
+    query = query.join(City, City.id == Forecast.city_id).where(
+        City.name == city_name.lower()
+    )
+    if datetime_from is not None:
+        query = query.where(Forecast.datetime >= datetime_from)
+    if datetime_to is not None:
+        query = query.where(Forecast.datetime <= datetime_to)
+    return query
+
+
+def select_forecasts(
+    city_name: str,
+    datetime_from: datetime | None = None,
+    datetime_to: datetime | None = None,
+):
+    query = _filter_forecasts(select(Forecast), city_name, datetime_from, datetime_to)
+    return query.order_by(Forecast.datetime)
+
+
+def select_forecast_page(
+    city_name: str,
+    limit: int,
+    datetime_from: datetime | None = None,
+    datetime_to: datetime | None = None,
+    after: tuple[datetime, int] | None = None,
+):
+    # Plain columns instead of entities, and one extra row to tell whether
+    # there is a next page.
+    query = _filter_forecasts(
+        select(
+            Forecast.id,
+            Forecast.city_id,
+            Forecast.datetime,
+            Forecast.forecasted_temperature,
+            Forecast.forecasted_humidity,
+        ),
+        city_name,
+        datetime_from,
+        datetime_to,
+    )
+    if after is not None:
+        query = query.where(tuple_(Forecast.datetime, Forecast.id) > after)
+    return query.order_by(Forecast.datetime, Forecast.id).limit(limit + 1)
@@ -10,6 +10,30 @@ class ForecastSchema(BaseModel):
     forecasted_humidity: float
 
 
+class ForecastItemSchema(ForecastSchema):
+    id: int
+
+
+class ForecastPageSchema(BaseModel):
+    items: list[ForecastItemSchema]
+    next_cursor: str | None
+
+
+class IngestErrorSchema(BaseModel):
+    line: int
+    # Set when a whole batch, lines `line` to `last_line`, was rejected.
+    last_line: int | None = None
+    error: str
+
+
+class IngestReportSchema(BaseModel):
+    inserted: int
+    rejected: int
+    errors: list[IngestErrorSchema]
+    seconds: float
+    rows_per_second: float
+
+
 class AccessTokenSchema(BaseModel):
     access_token: str
     token_type: str
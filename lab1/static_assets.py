@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+import mimetypes
+from pathlib import Path
+
+from fastapi import Request, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+
+GZIP_MINIMUM_SIZE = 500
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+)
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def fingerprint(name: str, body: bytes) -> str:
+    path = Path(name)
+    digest = hashlib.sha256(body).hexdigest()[:12]
+    return path.with_name(f"{path.stem}.{digest}{path.suffix}").as_posix()
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that also serves fingerprinted, pre-gzipped copies.
+
+    Every file is hashed and compressed once at startup. `url` returns the
+    hashed name, which can be cached forever because a new version of the
+    file gets a new name. Unhashed names are still served from disk.
+    """
+
+    def __init__(self, *, directory: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.manifest = {}
+        self.assets = {}
+        for path in sorted(Path(directory).rglob("*")):
+            if not path.is_file():
+                continue
+            name = path.relative_to(directory).as_posix()
+            body = path.read_bytes()
+            media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            compressed = None
+            if (
+                media_type.startswith(COMPRESSIBLE_TYPES)
+                and len(body) >= GZIP_MINIMUM_SIZE
+            ):
+                compressed = gzip.compress(body, compresslevel=9, mtime=0)
+                if len(compressed) >= len(body):
+                    compressed = None
+            hashed_name = fingerprint(name, body)
+            self.manifest[name] = hashed_name
+            self.assets[hashed_name] = (body, compressed, media_type)
+
+    def url(self, request: Request, name: str) -> str:
+        name = name.lstrip("/")
+        return str(request.url_for("static", path=self.manifest.get(name, name)))
+
+    async def get_response(self, path: str, scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        asset = self.assets.get(path)
+        if asset is None:
+            return await super().get_response(path, scope)
+        body, compressed, media_type = asset
+        headers = {"Cache-Control": IMMUTABLE}
+        if compressed is not None:
+            headers["Vary"] = "Accept-Encoding"
+            if "gzip" in Headers(scope=scope).get("accept-encoding", ""):
+                body = compressed
+                headers["Content-Encoding"] = "gzip"
+        return Response(body, media_type=media_type, headers=headers)
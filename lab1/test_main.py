@@ -0,0 +1,296 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, func, insert, select
+
+import authorization
+import ingest
+from authorization import create_access_token, token_cache, user_cache
+from ingest import ingest_forecasts
+from main import app
+from models import (
+    Base,
+    City,
+    Country,
+    Forecast,
+    SessionLocal,
+    User,
+    create_missing_forecast_versions,
+    create_missing_indexes,
+    engine,
+    read_engine,
+)
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    monkeypatch.setenv("SECRET_KEY", "test-secret")
+    user_cache.clear()
+    token_cache.clear()
+
+
+async def reset_database():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_missing_indexes)
+    async with SessionLocal() as db:
+        await db.execute(insert(Country).values(id=1, name="Ukraine", code="UA"))
+        await db.execute(
+            insert(City),
+            [
+                {"id": 1, "name": "kyiv", "country_id": 1},
+                {"id": 2, "name": "lviv", "country_id": 1},
+            ],
+        )
+        await db.execute(
+            insert(Forecast),
+            [
+                {
+                    "city_id": 1,
+                    "datetime": datetime(2024, 1, day),
+                    "forecasted_temperature": day,
+                    "forecasted_humidity": 50,
+                }
+                for day in (1, 2, 3)
+            ],
+        )
+        await db.commit()
+    async with engine.begin() as conn:
+        await conn.run_sync(create_missing_forecast_versions)
+    # Pooled connections belong to this event loop, not the test client's.
+    await engine.dispose()
+    await read_engine.dispose()
+
+
+@pytest.fixture
+def client():
+    asyncio.run(reset_database())
+    # Not entered as a context manager, so startup does not create users.
+    yield TestClient(app)
+    asyncio.run(engine.dispose())
+    asyncio.run(read_engine.dispose())
+
+
+def test_forecast_api_serves_anonymous_users_like_the_search_page(client):
+    page = client.get("/api/v1/forecasts", params={"city_name": "Kyiv"})
+    search = client.get("/forecasts", params={"city_name": "Kyiv"})
+
+    assert page.status_code == 200
+    assert [item["forecasted_temperature"] for item in page.json()["items"]] == [
+        1,
+        2,
+        3,
+    ]
+    assert search.status_code == 200
+
+
+def test_forecast_api_pages_with_a_cursor(client):
+    first = client.get(
+        "/api/v1/forecasts", params={"city_name": "kyiv", "limit": 2}
+    ).json()
+    second = client.get(
+        "/api/v1/forecasts",
+        params={"city_name": "kyiv", "limit": 2, "cursor": first["next_cursor"]},
+    ).json()
+
+    assert [item["forecasted_temperature"] for item in first["items"]] == [1, 2]
+    assert [item["forecasted_temperature"] for item in second["items"]] == [3]
+    assert second["next_cursor"] is None
+
+
+def test_forecast_api_rejects_an_invalid_token(client):
+    client.cookies.set("token", "not-a-jwt")
+
+    response = client.get("/api/v1/forecasts", params={"city_name": "kyiv"})
+
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Could not validate credentials"}
+
+
+async def insert_user(username, role):
+    async with SessionLocal() as db:
+        await db.execute(
+            insert(User).values(
+                username=username,
+                email=f"{username}@example.com",
+                hashed_password="",
+                role=role,
+            )
+        )
+        await db.commit()
+    await engine.dispose()
+
+
+def log_in_as(client, username, role="user"):
+    asyncio.run(insert_user(username, role))
+    client.cookies.set("token", create_access_token({"sub": username}).access_token)
+
+
+async def count_forecasts():
+    async with SessionLocal() as db:
+        count = await db.scalar(select(func.count()).select_from(Forecast))
+    await engine.dispose()
+    return count
+
+
+def upload(client, content, content_type):
+    return client.post(
+        "/api/v1/forecasts/bulk",
+        content=content,
+        headers={"content-type": content_type},
+    )
+
+
+def test_bulk_upload_of_csv_reports_rejected_lines(client):
+    log_in_as(client, "admin", role="admin")
+
+    response = upload(
+        client,
+        "city_id,datetime,forecasted_temperature,forecasted_humidity\n"
+        "1,2024-02-01T00:00:00,10,50\n"
+        "1,2024-02-02T00:00:00\n"
+        "1,2024-02-03T00:00:00,warm,50\n"
+        "\n"
+        "7,2024-02-04T00:00:00,10,50\n"
+        "1,2024-02-05T00:00:00,11,51",
+        "text/csv",
+    )
+    report = response.json()
+
+    assert response.status_code == 200
+    assert report["inserted"] == 2
+    assert report["rejected"] == 3
+    assert [error["line"] for error in report["errors"]] == [3, 4, 6]
+    assert report["errors"][0]["error"] == "Expected 4 columns, got 2"
+    assert report["errors"][1]["error"].startswith("forecasted_temperature: ")
+    assert report["errors"][2]["error"] == "City 7 not found"
+    assert asyncio.run(count_forecasts()) == 5
+
+
+def test_bulk_upload_of_ndjson_sniffs_the_content_type(client):
+    log_in_as(client, "admin", role="admin")
+    line = (
+        '{"city_id": 1, "datetime": "2024-02-01T00:00:00",'
+        ' "forecasted_temperature": 10, "forecasted_humidity": 50}'
+    )
+
+    response = upload(
+        client,
+        f"{line}\nnot json\n{{}}\n{line}\n",
+        "application/x-ndjson; charset=utf-8",
+    )
+    report = response.json()
+
+    assert response.status_code == 200
+    assert report["inserted"] == 2
+    assert [error["line"] for error in report["errors"]] == [2, 3]
+    assert report["errors"][1]["error"].startswith("city_id: Field required")
+    assert upload(client, f"{line}\n", "application/jsonl").json()["inserted"] == 1
+    assert upload(client, line, "application/json").status_code == 415
+    assert upload(client, line, "").status_code == 415
+
+
+def test_bulk_upload_caps_the_reported_errors(client, monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_REPORTED_ERRORS", 2)
+    log_in_as(client, "admin", role="admin")
+
+    report = upload(client, "not json\n" * 5, "application/x-ndjson").json()
+
+    assert report["rejected"] == 5
+    assert [error["line"] for error in report["errors"]] == [1, 2]
+
+
+def test_bulk_upload_needs_an_admin(client):
+    log_in_as(client, "user")
+
+    response = upload(client, "", "text/csv")
+
+    assert response.status_code == 403
+
+
+async def ingest_while_a_city_is_deleted():
+    async with SessionLocal() as db:
+        await db.execute(insert(City).values(id=3, name="odesa", country_id=1))
+        await db.commit()
+
+    async def chunks():
+        yield b"city_id,datetime,forecasted_temperature,forecasted_humidity\n"
+        yield b"1,2024-02-01T00:00:00,10,50\n1,2024-02-02T00:00:00,11,51\n"
+        async with SessionLocal() as db:
+            await db.execute(delete(City).where(City.id == 3))
+            await db.commit()
+        yield b"3,2024-02-03T00:00:00,12,52\n1,2024-02-04T00:00:00,13,53\n"
+        yield b"1,2024-02-05T00:00:00,14,54\n"
+
+    async with SessionLocal() as db:
+        report = await ingest_forecasts(db, chunks(), "csv", batch_size=2)
+    await engine.dispose()
+    await read_engine.dispose()
+    return report
+
+
+def test_a_batch_the_database_refuses_is_rejected_as_a_whole(client):
+    report = asyncio.run(ingest_while_a_city_is_deleted())
+
+    assert report["inserted"] == 3
+    assert report["rejected"] == 2
+    assert [
+        (error["line"], error["last_line"]) for error in report["errors"]
+    ] == [(4, 5)]
+    assert report["errors"][0]["error"].startswith("Batch not inserted: ")
+    assert asyncio.run(count_forecasts()) == 6
+
+
+def test_forecast_page_is_revalidated_until_its_city_changes(client):
+    log_in_as(client, "admin", role="admin")
+
+    def get(etag=None):
+        headers = {} if etag is None else {"if-none-match": etag}
+        return client.get("/forecasts", params={"city_name": "kyiv"}, headers=headers)
+
+    def forecast(city_id, day):
+        return {
+            "city_id": city_id,
+            "forecast_datetime": f"2024-03-{day:02d}T00:00:00",
+            "forecasted_temperature": day,
+            "forecasted_humidity": 50,
+        }
+
+    page = get()
+    etag = page.headers["etag"]
+
+    assert page.status_code == 200
+    assert "last-modified" in page.headers
+    assert get(etag).status_code == 304
+
+    # Changes to another city's forecasts leave the page's ETag alone.
+    assert client.post("/forecasts", data=forecast(2, 1)).status_code == 200
+    assert client.post("/forecasts/4", data=forecast(2, 2)).status_code == 200
+    assert client.delete("/forecasts/4").status_code == 200
+    assert get(etag).status_code == 304
+
+    for change in (
+        lambda: client.post("/forecasts", data=forecast(1, 3)),
+        lambda: client.post("/forecasts/1", data=forecast(1, 4)),
+        lambda: client.delete("/forecasts/2"),
+    ):
+        assert change().status_code == 200
+        page = get(etag)
+        assert page.status_code == 200
+        assert page.headers["etag"] != etag
+        etag = page.headers["etag"]
+        assert get(etag).status_code == 304
+
+
+def test_a_cached_user_needs_no_session(client, monkeypatch):
+    log_in_as(client, "admin", role="admin")
+    client.get("/forecasts", params={"city_name": "kyiv"})
+    # Any session opened for the user would now fail.
+    monkeypatch.setattr(authorization, "ReadSessionLocal", None)
+
+    response = client.get("/password-hasher-stats")
+
+    assert response.status_code == 200
@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import sqlite
+
+from models import Base, create_missing_indexes, select_forecast_page, select_forecasts
+
+FORECAST_INDEX = "ix_forecasts_city_id_datetime_id"
+BAD_PLAN_STEPS = ("SCAN forecasts", "USE TEMP B-TREE")
+
+BOUNDS = [
+    (None, None),
+    (datetime(2024, 1, 1), None),
+    (None, datetime(2024, 1, 1)),
+    (datetime(2024, 1, 1), datetime(2024, 2, 1)),
+]
+QUERIES = {
+    "select_forecasts": lambda datetime_from, datetime_to: select_forecasts(
+        "kyiv", datetime_from, datetime_to
+    ),
+    "select_forecast_page": lambda datetime_from, datetime_to: select_forecast_page(
+        "kyiv", 100, datetime_from, datetime_to, (datetime(2024, 1, 1), 1)
+    ),
+}
+
+
+@pytest.fixture
+def conn(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sqlite.db'}")
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        create_missing_indexes(conn)
+    with engine.connect() as conn:
+        yield conn
+    engine.dispose()
+
+
+def explain(conn, query):
+    compiled = query.compile(dialect=sqlite.dialect())
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)
+    return [row[3] for row in rows]
+
+
+@pytest.mark.parametrize("datetime_from, datetime_to", BOUNDS)
+@pytest.mark.parametrize("query", QUERIES.values(), ids=QUERIES.keys())
+def test_forecast_queries_use_the_covering_index(
+    conn, query, datetime_from, datetime_to
+):
+    plan = explain(conn, query(datetime_from, datetime_to))
+
+    assert any(FORECAST_INDEX in step for step in plan), plan
+    assert not [step for step in plan if step.startswith(BAD_PLAN_STEPS)], plan
+
+
+def test_create_missing_indexes_replaces_obsolete_ones(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sqlite.db'}")
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        conn.execute(text(f"DROP INDEX {FORECAST_INDEX}"))
+        conn.execute(
+            text(
+                "CREATE INDEX ix_forecasts_city_id_datetime "
+                "ON forecasts (city_id, datetime)"
+            )
+        )
+        create_missing_indexes(conn)
+        indexes = {
+            row[0]
+            for row in conn.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index'")
+            )
+        }
+    engine.dispose()
+
+    assert FORECAST_INDEX in indexes
+    assert "ix_forecasts_city_id_datetime" not in indexes
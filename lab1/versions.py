@@ -0,0 +1,47 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request
+
+
+def page_headers(version: tuple[int, datetime] | None, *variant) -> dict[str, str]:
+    """Validators for a page at `version`, varying on `variant`.
+
+    `version` is the (counter, change time) pair stored with the data, so
+    every worker derives the same validators. Without one there is nothing
+    to validate against and the page is always sent in full.
+    """
+    headers = {"Cache-Control": "no-cache", "Vary": "Cookie"}
+    if version is None:
+        return headers
+    number, changed_at = version
+    if changed_at.tzinfo is None:
+        changed_at = changed_at.replace(tzinfo=timezone.utc)
+    # The change time tells apart versions of a database that was recreated.
+    digest = hashlib.sha1(
+        repr((number, changed_at.isoformat(), variant)).encode()
+    ).hexdigest()
+    headers["ETag"] = f'W/"{digest[:20]}"'
+    headers["Last-Modified"] = format_datetime(
+        changed_at.astimezone(timezone.utc), usegmt=True
+    )
+    return headers
+
+
+def is_not_modified(request: Request, headers: dict[str, str]) -> bool:
+    if "ETag" not in headers:
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+        return "*" in etags or headers["ETag"].removeprefix("W/") in etags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+        last_modified = parsedate_to_datetime(headers["Last-Modified"])
+    except (TypeError, ValueError):
+        return False
+    return last_modified <= since
@@ -1,4 +1,9 @@
+import asyncio
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Annotated
@@ -7,9 +12,9 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import APIKeyCookie
 from jose import JWTError, jwt, ExpiredSignatureError
 from passlib.context import CryptContext
-from psycopg import Cursor
+from psycopg import AsyncCursor
 
-from models import get_db
+from models import pool
 
 
 @dataclass
@@ -29,12 +34,127 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool instead of the event loop."""
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hasher"
+        )
+        self.slots = asyncio.Semaphore(workers)
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def run(self, func, *args):
+        if self.queued >= self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many login attempts, try again later",
+            )
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.slots.release()
+
+    def get_stats(self):
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+password_hasher = PasswordHasher(
+    workers=int(os.getenv("PASSWORD_HASHER_WORKERS", 2)),
+    queue_limit=int(os.getenv("PASSWORD_HASHER_QUEUE_LIMIT", 32)),
+)
+
+
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+USER_CACHE_MAXSIZE = int(os.getenv("USER_CACHE_MAXSIZE", 1024))
+USER_CACHE_TTL = min(
+    float(os.getenv("USER_CACHE_TTL", 60)), ACCESS_TOKEN_EXPIRE_MINUTES * 60
+)
+TOKEN_CACHE_MAXSIZE = int(os.getenv("TOKEN_CACHE_MAXSIZE", 4096))
+
 api_key_scheme = APIKeyCookie(name="token", auto_error=False)
 
 
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a time to live."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self.items[key]
+                return default
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float | None = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.items[key] = (value, expires_at)
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            return self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+user_cache = TTLCache(USER_CACHE_MAXSIZE, USER_CACHE_TTL)
+token_cache = TTLCache(TOKEN_CACHE_MAXSIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+def invalidate_user(username: str):
+    """Must be called whenever a user's role changes or the user is deleted."""
+    user_cache.pop(username)
+
+
+def decode_token(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, os.getenv("SECRET_KEY"), algorithms=[ALGORITHM])
+        # The signature was just verified, the entry only has to expire with the token.
+        token_cache.set(token, payload, ttl=payload["exp"] - time.time())
+    return payload
+
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -43,57 +163,60 @@ def create_access_token(data: dict):
     return AccessToken(access_token=encoded_jwt, token_type="bearer")
 
 
-def authenticate_user(db: Cursor, username: str, password: str):
-    db.execute(
+async def authenticate_user(db: AsyncCursor, username: str, password: str):
+    await db.execute(
         """
             SELECT * FROM users WHERE username = %s
         """,
         (username,),
     )
-    user = db.fetchone()
-    if user and verify_password(password, user.hashed_password):
+    user = await db.fetchone()
+    if user and await password_hasher.run(
+        verify_password, password, user.hashed_password
+    ):
         return user
     return None
 
 
-def create_superadmin(db: Cursor):
+async def create_superadmin(db: AsyncCursor):
     email = os.getenv("SUPERADMIN_EMAIL")
     password = os.getenv("SUPERADMIN_PASSWORD")
-    hashed_password = get_password_hash(password)
 
-    db.execute("SELECT * FROM users WHERE email = %s", (email,))
-    superadmin = db.fetchone()
+    await db.execute("SELECT * FROM users WHERE email = %s", (email,))
+    superadmin = await db.fetchone()
 
     if not superadmin:
-        db.execute(
+        hashed_password = await password_hasher.run(get_password_hash, password)
+        await db.execute(
             """
             INSERT INTO users (username, email, hashed_password, role)
             VALUES (%s, %s, %s, %s)
             """,
             ("superadmin", email, hashed_password, "admin"),
         )
+        invalidate_user("superadmin")
 
 
-def create_example_user(db: Cursor):
+async def create_example_user(db: AsyncCursor):
     email = "user@example.com"
     password = "userpasswordexample"
-    hashed_password = get_password_hash(password)
 
-    db.execute("SELECT * FROM users WHERE email = %s", (email,))
-    user = db.fetchone()
+    await db.execute("SELECT * FROM users WHERE email = %s", (email,))
+    user = await db.fetchone()
 
     if not user:
-        db.execute(
+        hashed_password = await password_hasher.run(get_password_hash, password)
+        await db.execute(
             """
             INSERT INTO users (username, email, hashed_password, role)
             VALUES (%s, %s, %s, %s)
             """,
             ("user", email, hashed_password, "user"),
         )
+        invalidate_user("user")
 
 
-def get_current_user(
-    db: Annotated[Cursor, Depends(get_db)],
+async def get_current_user(
     token: Annotated[str, Depends(api_key_scheme)],
 ):
     if token is None:
@@ -104,14 +227,20 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, os.getenv("SECRET_KEY"), algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        db.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = db.fetchone()
+        user = user_cache.get(username)
         if user is None:
-            raise credentials_exception
+            # A connection is only taken from the pool on a cache miss, so
+            # cached users cost none.
+            async with pool.connection() as conn, conn.cursor() as db:
+                await db.execute("SELECT * FROM users WHERE username = %s", (username,))
+                user = await db.fetchone()
+            if user is None:
+                raise credentials_exception
+            user_cache.set(username, user)
         return user
     except ExpiredSignatureError:
         return None
@@ -1,15 +1,24 @@
+import json
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Literal
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, HTTPException, Depends, status, Form
 from fastapi.exceptions import HTTPException as StarletteHTTPException
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import (
+    HTMLResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from psycopg import Cursor
+from jinja2 import Environment, FileSystemLoader
+from psycopg import AsyncCursor
+from psycopg.errors import ForeignKeyViolation
+from starlette.background import BackgroundTask
 
 from authorization import (
     authenticate_user,
@@ -18,17 +27,42 @@ from authorization import (
     create_superadmin,
     get_superadmin,
     get_current_user,
+    password_hasher,
+)
+from migration import (
+    FORECAST_SEARCH_QUERY,
+    FORECAST_VERSION_QUERY,
+    FORECAST_VERSIONS_TABLE,
+    INDEXES,
+    REGISTER_FORECAST_VERSIONS,
+    bumping_forecast_versions,
+)
+from models import (
+    get_db,
+    get_pool_stats,
+    open_pool,
+    close_pool,
+    pool,
+    stream_rows,
 )
-from models import get_db, get_cursor
+from static_assets import GZIP_MINIMUM_SIZE, PrecompressedStaticFiles
+from versions import is_not_modified, page_headers
 
 
 async def startup_event():
-    db = get_cursor()
-    try:
-        create_superadmin(db)
-        create_example_user(db)
-    finally:
-        db.close()
+    await open_pool()
+    async with pool.connection() as conn:
+        async with conn.cursor() as db:
+            for index in INDEXES.values():
+                await db.execute(index)
+            await db.execute(FORECAST_VERSIONS_TABLE)
+            await db.execute(REGISTER_FORECAST_VERSIONS)
+            await create_superadmin(db)
+            await create_example_user(db)
+
+
+async def shutdown_event():
+    await close_pool()
 
 
 app = FastAPI(
@@ -42,8 +76,18 @@ app = FastAPI(
 )
 
 app.add_event_handler("startup", startup_event)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.add_event_handler("shutdown", shutdown_event)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+static_files = PrecompressedStaticFiles(directory="static")
+app.mount("/static", static_files, name="static")
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["static_url"] = static_files.url
+stream_templates = Jinja2Templates(
+    env=Environment(
+        loader=FileSystemLoader("templates"), autoescape=True, enable_async=True
+    )
+)
+stream_templates.env.globals["static_url"] = static_files.url
 
 
 @app.exception_handler(StarletteHTTPException)
@@ -59,24 +103,26 @@ async def http_exception_handler(
 
 
 @app.get("/", tags=["Forecasts"], response_class=HTMLResponse)
-def index(
+async def index(
     request: Request,
-    db: Annotated[Cursor, Depends(get_db)],
+    db: Annotated[AsyncCursor, Depends(get_db)],
     user=Depends(get_current_user),
 ):
-    cities = db.execute("select * from cities").fetchall()
+    await db.execute("select * from cities")
+    cities = await db.fetchall()
     return templates.TemplateResponse(
         name="index.html", request=request, context={"user": user, "cities": cities}
     )
 
 
 @app.get("/create-forecast", tags=["Forecasts"], response_class=HTMLResponse)
-def create_forecast(
+async def create_forecast(
     request: Request,
-    db: Annotated[Cursor, Depends(get_db)],
+    db: Annotated[AsyncCursor, Depends(get_db)],
     user=Depends(get_superadmin),
 ):
-    cities = db.execute("select * from cities").fetchall()
+    await db.execute("select * from cities")
+    cities = await db.fetchall()
     return templates.TemplateResponse(
         name="create_forecast.html",
         request=request,
@@ -85,12 +131,13 @@ def create_forecast(
 
 
 @app.get("/add-city", response_class=HTMLResponse)
-def add_city(
+async def add_city(
     request: Request,
-    db: Annotated[Cursor, Depends(get_db)],
+    db: Annotated[AsyncCursor, Depends(get_db)],
     user=Depends(get_superadmin),
 ):
-    countries = db.execute("select * from countries").fetchall()
+    await db.execute("select * from countries")
+    countries = await db.fetchall()
     return templates.TemplateResponse(
         name="add_city.html",
         request=request,
@@ -99,7 +146,7 @@ def add_city(
 
 
 @app.get("/add-country", response_class=HTMLResponse)
-def add_country(
+async def add_country(
     request: Request,
     user=Depends(get_superadmin),
 ):
@@ -113,16 +160,16 @@ def add_country(
 @app.get(
     "/edit-forecast/{forecast_id}", tags=["Forecasts"], response_class=HTMLResponse
 )
-def edit_forecast(
+async def edit_forecast(
     request: Request,
     forecast_id: int,
-    db: Annotated[Cursor, Depends(get_db)],
+    db: Annotated[AsyncCursor, Depends(get_db)],
     user=Depends(get_superadmin),
 ):
-    db.execute("select * from forecasts where id = %s", (forecast_id,))
-    forecast = db.fetchone()
-    db.execute("select * from cities")
-    cities = db.fetchall()
+    await db.execute("select * from forecasts where id = %s", (forecast_id,))
+    forecast = await db.fetchone()
+    await db.execute("select * from cities")
+    cities = await db.fetchall()
     return templates.TemplateResponse(
         name="edit_forecast.html",
         request=request,
@@ -142,22 +189,25 @@ async def create_forecast(
     forecast_datetime: Annotated[datetime, Form()],
     forecasted_temperature: Annotated[float, Form()],
     forecasted_humidity: Annotated[float, Form()],
-    db: Annotated[Cursor, Depends(get_db)],
+    db: Annotated[AsyncCursor, Depends(get_db)],
     user=Depends(get_superadmin),
 ):
-    db.execute("select * from cities where id = %s", (city_id,))
-    city = db.fetchone()
-    if city is None:
+    try:
+        await db.execute(
+            bumping_forecast_versions(
+                """
+                insert into forecasts (city_id, datetime, forecasted_temperature, forecasted_humidity) 
+                VALUES (%s, %s, %s, %s)
+                RETURNING (SELECT name FROM cities WHERE id = forecasts.city_id) AS city_name
+                """,
+                "city_name",
+            ),
+            (city_id, forecast_datetime, forecasted_temperature, forecasted_humidity),
+        )
+    except ForeignKeyViolation:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="City not found"
         )
-    db.execute(
-        """
-            insert into forecasts (city_id, datetime, forecasted_temperature, forecasted_humidity) 
-            VALUES (%s, %s, %s, %s)
-        """,
-        (city_id, forecast_datetime, forecasted_temperature, forecasted_humidity),
-    )
     return templates.TemplateResponse(
         name="message.html",
         request=request,
@@ -174,10 +224,10 @@ async def add_country(
     request: Request,
     country_name: Annotated[str, Form()],
     country_code: Annotated[str, Form()],
-    db: Annotated[Cursor, Depends(get_db)],
+    db: Annotated[AsyncCursor, Depends(get_db)],
     user=Depends(get_superadmin),
 ):
-    db.execute(
+    await db.execute(
         """
             insert into countries (name, code) 
             VALUES (%s, %s)
@@ -200,16 +250,16 @@ async def add_city(
     request: Request,
     country_id: Annotated[int, Form()],
     city_name: Annotated[str, Form()],
-    db: Annotated[Cursor, Depends(get_db)],
+    db: Annotated[AsyncCursor, Depends(get_db)],
     user=Depends(get_superadmin),
 ):
-    db.execute("select * from countries where id = %s", (country_id,))
-    city = db.fetchone()
+    await db.execute("select * from countries where id = %s", (country_id,))
+    city = await db.fetchone()
     if city is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Country not found"
         )
-    db.execute(
+    await db.execute(
         """
             insert into cities (name, country_id) 
             VALUES (%s, %s)
@@ -223,35 +273,110 @@ async def add_city(
     )
 
 
+def forecast_search_params(city_name, forecast_datetime_from, forecast_datetime_to):
+    return (
+        city_name,
+        forecast_datetime_to or "infinity",
+        forecast_datetime_from or "-infinity",
+    )
+
+
+async def forecast_page_headers(db, city_name, user):
+    await db.execute(FORECAST_VERSION_QUERY, (city_name,))
+    return page_headers(
+        await db.fetchone(), city_name.lower(), user.username if user else None
+    )
+
+
+async def prepend(first, rows):
+    yield first
+    async for row in rows:
+        yield row
+
+
+async def close_streams(*streams):
+    # Starlette does not close a body iterator that stops early, which would
+    # keep the rows' connection checked out until garbage collection.
+    for stream in streams:
+        await stream.aclose()
+
+
+async def to_ndjson(forecasts):
+    async for forecast in forecasts:
+        yield json.dumps(forecast._asdict(), default=datetime.isoformat) + "\n"
+
+
+@app.get("/forecasts/stream", tags=["Forecasts"], response_class=StreamingResponse)
+async def stream_forecast(
+    request: Request,
+    city_name: str,
+    db: Annotated[AsyncCursor, Depends(get_db)],
+    user=Depends(get_current_user),
+    forecast_datetime_from: datetime | None = None,
+    forecast_datetime_to: datetime | None = None,
+    format: Literal["html", "ndjson"] = "html",
+):
+    headers = await forecast_page_headers(db, city_name, user)
+    if is_not_modified(request, headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    # Dependencies are closed before a streaming body is sent, so the rows
+    # are read through a connection owned by the generator itself.
+    rows = stream_rows(
+        FORECAST_SEARCH_QUERY,
+        forecast_search_params(
+            city_name, forecast_datetime_from, forecast_datetime_to
+        ),
+    )
+    first = await anext(rows, None)
+    if first is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Forecasts not found"
+        )
+    forecasts = prepend(first, rows)
+
+    if format == "ndjson":
+        body = to_ndjson(forecasts)
+        media_type = "application/x-ndjson"
+    else:
+        body = stream_templates.get_template("forecasts.html").generate_async(
+            {
+                "request": request,
+                "user": user,
+                "city_name": city_name,
+                "forecast_datetime_from": forecast_datetime_from,
+                "forecast_datetime_to": forecast_datetime_to,
+                "forecasts": forecasts,
+            }
+        )
+        media_type = "text/html"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers=headers,
+        # Runs however the response ends, disconnects included.
+        background=BackgroundTask(close_streams, body, forecasts, rows),
+    )
+
+
 @app.get("/forecasts", tags=["Forecasts"], response_class=HTMLResponse)
-def get_forecast(
+async def get_forecast(
     request: Request,
     city_name: str,
-    db: Annotated[Cursor, Depends(get_db)],
+    db: Annotated[AsyncCursor, Depends(get_db)],
     user=Depends(get_current_user),
     forecast_datetime_from: datetime | None = None,
     forecast_datetime_to: datetime | None = None,
 ):
-    forecast_datetime_to_str = forecast_datetime_to
-    forecast_datetime_from_str = forecast_datetime_from
-    if not forecast_datetime_to:
-        forecast_datetime_to_str = "infinity"
-    if not forecast_datetime_from:
-        forecast_datetime_from_str = "-infinity"
-
-    db.execute(
-        """
-            SELECT forecasts.*
-            FROM forecasts
-            JOIN cities ON cities.id = forecasts.city_id
-            WHERE LOWER(cities.name) = LOWER(%s)
-              AND forecasts.datetime <= %s
-              AND forecasts.datetime >= %s
-            ORDER BY forecasts.datetime;
-        """,
-        (city_name, forecast_datetime_to_str, forecast_datetime_from_str),
+    headers = await forecast_page_headers(db, city_name, user)
+    if is_not_modified(request, headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    await db.execute(
+        FORECAST_SEARCH_QUERY,
+        forecast_search_params(
+            city_name, forecast_datetime_from, forecast_datetime_to
+        ),
     )
-    forecasts = db.fetchall()
+    forecasts = await db.fetchall()
     if len(forecasts) == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Forecasts not found"
@@ -266,6 +391,7 @@ def get_forecast(
             "forecast_datetime_to": forecast_datetime_to,
             "forecasts": forecasts,
         },
+        headers=headers,
     )
 
 
@@ -281,38 +407,50 @@ async def update_forecast(
     forecast_datetime: Annotated[datetime, Form()],
     forecasted_temperature: Annotated[float, Form()],
     forecasted_humidity: Annotated[float, Form()],
-    db: Annotated[Cursor, Depends(get_db)],
+    db: Annotated[AsyncCursor, Depends(get_db)],
     user=Depends(get_superadmin),
 ):
-    db.execute("SELECT 1 FROM forecasts WHERE id = %s", (forecast_id,))
-    if not db.fetchone():
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Forecast not found"
+    # A missing forecast matches no row, so the city foreign key is only
+    # checked when the forecast exists, same order as the separate lookups.
+    # The self join exposes the row as it was before the update, so both the
+    # old and the new city are known.
+    try:
+        await db.execute(
+            bumping_forecast_versions(
+                """
+                UPDATE forecasts
+                SET city_id = %s,
+                    datetime = %s,
+                    forecasted_temperature = %s,
+                    forecasted_humidity = %s
+                FROM forecasts AS previous
+                WHERE forecasts.id = %s AND previous.id = forecasts.id
+                RETURNING
+                    (SELECT name FROM cities WHERE id = previous.city_id)
+                        AS previous_city_name,
+                    (SELECT name FROM cities WHERE id = forecasts.city_id)
+                        AS city_name
+                """,
+                "previous_city_name",
+                "city_name",
+            ),
+            (
+                city_id,
+                forecast_datetime,
+                forecasted_temperature,
+                forecasted_humidity,
+                forecast_id,
+            ),
         )
-
-    db.execute("SELECT 1 FROM cities WHERE id = %s", (city_id,))
-    if not db.fetchone():
+    except ForeignKeyViolation:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="City not found"
         )
-
-    db.execute(
-        """
-            UPDATE forecasts
-            SET city_id = %s,
-                datetime = %s,
-                forecasted_temperature = %s,
-                forecasted_humidity = %s
-            WHERE id = %s
-        """,
-        (
-            city_id,
-            forecast_datetime,
-            forecasted_temperature,
-            forecasted_humidity,
-            forecast_id,
-        ),
-    )
+    updated_forecast = await db.fetchone()
+    if not updated_forecast:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Forecast not found"
+        )
     return templates.TemplateResponse(
         name="message.html",
         request=request,
@@ -321,21 +459,25 @@ async def update_forecast(
 
 
 @app.delete("/forecasts/{forecast_id}", tags=["Forecasts"])
-def delete_forecast(
+async def delete_forecast(
     request: Request,
     forecast_id: int,
-    db: Annotated[Cursor, Depends(get_db)],
+    db: Annotated[AsyncCursor, Depends(get_db)],
     user=Depends(get_superadmin),
 ):
-    db.execute(
-        """
-                DELETE FROM forecasts WHERE id = %s RETURNING id
+    await db.execute(
+        bumping_forecast_versions(
+            """
+                DELETE FROM forecasts WHERE id = %s
+                RETURNING (SELECT name FROM cities WHERE id = forecasts.city_id) AS city_name
             """,
+            "city_name",
+        ),
         (forecast_id,),
     )
-    deleted_forecast_id = db.fetchone()
+    deleted_forecast = await db.fetchone()
 
-    if not deleted_forecast_id:
+    if not deleted_forecast:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Forecast not found"
         )
@@ -347,6 +489,16 @@ def delete_forecast(
     )
 
 
+@app.get("/pool-stats", tags=["Monitoring"])
+def pool_stats(user=Depends(get_superadmin)):
+    return get_pool_stats()
+
+
+@app.get("/password-hasher-stats", tags=["Monitoring"])
+async def password_hasher_stats(user=Depends(get_superadmin)):
+    return password_hasher.get_stats()
+
+
 @app.get("/login", tags=["Authorization"], response_class=HTMLResponse)
 async def login(request: Request):
     return templates.TemplateResponse(
@@ -365,9 +517,9 @@ async def logout():
 @app.post("/token", tags=["Authorization"], response_class=RedirectResponse)
 async def get_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Annotated[Cursor, Depends(get_db)],
+    db: Annotated[AsyncCursor, Depends(get_db)],
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,10 +1,15 @@
+import argparse
 import os
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 
 import psycopg
 from dotenv import load_dotenv
 
 SQLITE_DB_PATH = "../lab1/sqlite.db"
+BATCH_SIZE = 10_000
 
 load_dotenv()
 
@@ -13,63 +18,245 @@ POSTGRES_USER = "postgres"
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_HOST = "localhost"
 
-if __name__ == "__main__":
-    sqlite_conn = sqlite3.connect(SQLITE_DB_PATH)
-    sqlite_cursor = sqlite_conn.cursor()
+INDEXES = {
+    "cities_lower_name_idx": "CREATE INDEX IF NOT EXISTS cities_lower_name_idx "
+    "ON cities (LOWER(name));",
+    "forecasts_city_id_datetime_idx": "CREATE INDEX IF NOT EXISTS "
+    "forecasts_city_id_datetime_idx ON forecasts (city_id, datetime);",
+}
+
+# Change counters of each city's forecasts, used to validate cached pages.
+# Every write bumps them in the same statement, so all workers agree on them.
+FORECAST_VERSIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS forecast_versions (
+        city_name TEXT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 1,
+        changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+# Cities never changed through the app get a first version.
+REGISTER_FORECAST_VERSIONS = """
+    INSERT INTO forecast_versions (city_name)
+    SELECT LOWER(name) FROM cities
+    ON CONFLICT DO NOTHING;
+"""
+FORECAST_VERSION_QUERY = """
+    SELECT version, changed_at FROM forecast_versions WHERE city_name = LOWER(%s);
+"""
+# lab1 keeps its own forecast_versions; they describe that database only.
+SKIPPED_TABLES = {"forecast_versions"}
+
+FORECAST_SEARCH_QUERY = """
+    SELECT forecasts.*
+    FROM forecasts
+    JOIN cities ON cities.id = forecasts.city_id
+    WHERE LOWER(cities.name) = LOWER(%s)
+      AND forecasts.datetime <= %s
+      AND forecasts.datetime >= %s
+    ORDER BY forecasts.datetime;
+"""
+
+
+def bumping_forecast_versions(statement, *city_name_columns):
+    """Wrap a write RETURNING city names so that it bumps their versions too."""
+    city_names = " UNION ".join(
+        f"SELECT LOWER({column}) FROM changed" for column in city_name_columns
+    )
+    return f"""
+        WITH changed AS ({statement}),
+        bumped AS (
+            INSERT INTO forecast_versions AS versions (city_name)
+            {city_names}
+            ON CONFLICT (city_name) DO UPDATE
+            SET version = versions.version + 1, changed_at = now()
+        )
+        SELECT * FROM changed;
+    """
+
+
+def create_forecast_versions(pg_cursor):
+    pg_cursor.execute(FORECAST_VERSIONS_TABLE)
+    pg_cursor.execute(REGISTER_FORECAST_VERSIONS)
 
-    pg_conn = psycopg.connect(
+
+def create_indexes(pg_cursor):
+    for index in INDEXES.values():
+        pg_cursor.execute(index)
+    pg_cursor.execute("ANALYZE cities;")
+    pg_cursor.execute("ANALYZE forecasts;")
+
+
+def check_forecast_search_plan(pg_cursor, city_name="kyiv"):
+    # Small tables are cheaper to scan sequentially, so sequential scans are
+    # disabled to check that the planner is able to use the indexes at all.
+    # With them off it falls back to the primary keys, so the plan has to
+    # name the search indexes themselves.
+    pg_cursor.execute("SET enable_seqscan = off;")
+    try:
+        pg_cursor.execute(
+            "EXPLAIN " + FORECAST_SEARCH_QUERY,
+            (city_name, "infinity", "-infinity"),
+        )
+        plan = "\n".join(row[0] for row in pg_cursor.fetchall())
+    finally:
+        pg_cursor.execute("RESET enable_seqscan;")
+    print(plan)
+    missing = [name for name in INDEXES if name not in plan]
+    if missing:
+        raise RuntimeError(
+            f"Forecast search does not use the indexes: {', '.join(missing)}"
+        )
+
+
+def connect_postgres():
+    return psycopg.connect(
         dbname=POSTGRES_DB_NAME,
         user=POSTGRES_USER,
         password=POSTGRES_PASSWORD,
         host=POSTGRES_HOST,
     )
 
-    pg_cursor = pg_conn.cursor()
-
-    sqlite_cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = sqlite_cursor.fetchall()
-
-    for table in tables:
-        all_info = {}
-        table_name = table[0]
-        sqlite_cursor.execute(f"PRAGMA table_info({table_name});")
-        columns_info = sqlite_cursor.fetchall()
-        all_info[table_name] = [i[1] for i in columns_info]
-
-        create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ("
-        for column_info in columns_info:
-            column_name = column_info[1]
-            column_type = column_info[2]
-            if column_name == "id":
-                column_type = "SERIAL"
-            if column_type == "DATETIME":
-                column_type = "TIMESTAMP"
-            create_table_query += f"{column_name} {column_type} "
-            if column_name == ("name" or "username" or "email"):
-                create_table_query += f"UNIQUE, "
-            else:
-                create_table_query += ", "
-
-        create_table_query += "PRIMARY KEY (id)"
-        if table_name == "forecasts":
-            create_table_query += ", FOREIGN KEY (city_id) REFERENCES cities(id)"
-        if table_name == "cities":
-            create_table_query += ", FOREIGN KEY (country_id) REFERENCES countries(id)"
-        create_table_query += ");"
-        pg_cursor.execute(create_table_query)
+
+def get_table_levels(sqlite_cursor):
+    """Group tables so that every table comes after the tables it references."""
+    sqlite_cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';"
+    )
+    tables = [
+        row[0] for row in sqlite_cursor.fetchall() if row[0] not in SKIPPED_TABLES
+    ]
+    references = {}
+    for table_name in tables:
+        sqlite_cursor.execute(f"PRAGMA foreign_key_list({table_name});")
+        references[table_name] = {
+            row[2] for row in sqlite_cursor.fetchall() if row[2] != table_name
+        }
+
+    levels = []
+    done = set()
+    while len(done) < len(tables):
+        level = [
+            table_name
+            for table_name in tables
+            if table_name not in done and references[table_name] <= done
+        ]
+        if not level:
+            raise RuntimeError("Circular foreign keys between tables")
+        levels.append(level)
+        done.update(level)
+    return levels
+
+
+def create_table(sqlite_cursor, pg_cursor, table_name):
+    sqlite_cursor.execute(f"PRAGMA table_info({table_name});")
+    columns_info = sqlite_cursor.fetchall()
+
+    create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ("
+    for column_info in columns_info:
+        column_name = column_info[1]
+        column_type = column_info[2]
+        if column_name == "id":
+            column_type = "SERIAL"
+        if column_type == "DATETIME":
+            column_type = "TIMESTAMP"
+        create_table_query += f"{column_name} {column_type} "
+        if column_name == ("name" or "username" or "email"):
+            create_table_query += "UNIQUE, "
+        else:
+            create_table_query += ", "
+
+    create_table_query += "PRIMARY KEY (id)"
+    if table_name == "forecasts":
+        create_table_query += ", FOREIGN KEY (city_id) REFERENCES cities(id)"
+    if table_name == "cities":
+        create_table_query += ", FOREIGN KEY (country_id) REFERENCES countries(id)"
+    create_table_query += ");"
+    pg_cursor.execute(create_table_query)
+    return [column_info[1] for column_info in columns_info]
+
+
+def copy_table(table_name, columns, batch_size=BATCH_SIZE):
+    """Copy one table in a single transaction, so a crash leaves it empty."""
+    with (
+        connect_postgres() as pg_conn,
+        closing(sqlite3.connect(SQLITE_DB_PATH)) as sqlite_conn,
+    ):
+        pg_cursor = pg_conn.cursor()
+        pg_cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table_name});")
+        if pg_cursor.fetchone()[0]:
+            print(f"{table_name}: already migrated, skipping")
+            return
+
+        names = ", ".join(columns)
+        sqlite_cursor = sqlite_conn.execute(f"SELECT {names} FROM {table_name};")
+        migrated = 0
+        started = time.perf_counter()
+        with pg_cursor.copy(f"COPY {table_name} ({names}) FROM STDIN") as copy:
+            while rows := sqlite_cursor.fetchmany(batch_size):
+                for row in rows:
+                    copy.write_row(row)
+                migrated += len(rows)
+                elapsed = time.perf_counter() - started
+                print(
+                    f"{table_name}: {migrated} rows, "
+                    f"{migrated / elapsed:.0f} rows/s"
+                )
+
+        # Ids are copied as is, so the serial sequence has to continue after them.
+        pg_cursor.execute(
+            f"""
+                SELECT setval(
+                    pg_get_serial_sequence('{table_name}', 'id'),
+                    COALESCE(MAX(id), 1),
+                    MAX(id) IS NOT NULL
+                )
+                FROM {table_name};
+            """
+        )
         pg_conn.commit()
+    elapsed = time.perf_counter() - started
+    print(f"{table_name}: done, {migrated} rows in {elapsed:.1f}s")
 
-        sqlite_cursor.execute(f"SELECT * FROM {table_name};")
-        rows = sqlite_cursor.fetchall()
-        for row in rows:
-            names = ", ".join(all_info[table_name][1:])
-            placeholders = ", ".join(["%s" for _ in range(len(row) - 1)])
-            pg_cursor.execute(
-                f"INSERT INTO {table_name}({names}) VALUES ({placeholders});", row[1:]
-            )
+
+def migrate(jobs=1, batch_size=BATCH_SIZE):
+    with (
+        closing(sqlite3.connect(SQLITE_DB_PATH)) as sqlite_conn,
+        connect_postgres() as pg_conn,
+    ):
+        sqlite_cursor = sqlite_conn.cursor()
+        levels = get_table_levels(sqlite_cursor)
+        pg_cursor = pg_conn.cursor()
+        columns = {}
+        for level in levels:
+            for table_name in level:
+                columns[table_name] = create_table(sqlite_cursor, pg_cursor, table_name)
+        pg_conn.commit()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for level in levels:
+            futures = [
+                executor.submit(copy_table, table_name, columns[table_name], batch_size)
+                for table_name in level
+            ]
+            for future in futures:
+                future.result()
+
+    with connect_postgres() as pg_conn:
+        pg_cursor = pg_conn.cursor()
+        create_indexes(pg_cursor)
+        create_forecast_versions(pg_cursor)
         pg_conn.commit()
+        check_forecast_search_plan(pg_cursor)
 
-    sqlite_cursor.close()
-    sqlite_conn.close()
-    pg_cursor.close()
-    pg_conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate lab1 SQLite data to Postgres")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of tables without dependencies between them copied in parallel",
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    migrate(jobs=args.jobs, batch_size=args.batch_size)
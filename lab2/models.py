@@ -1,5 +1,9 @@
-import psycopg
+import os
+
+import anyio
+from psycopg.conninfo import make_conninfo
 from psycopg.rows import namedtuple_row
+from psycopg_pool import AsyncConnectionPool
 
 from migration import (
     POSTGRES_DB_NAME,
@@ -8,22 +12,69 @@ from migration import (
     POSTGRES_HOST,
 )
 
+POSTGRES_POOL_MIN_SIZE = int(os.getenv("POSTGRES_POOL_MIN_SIZE", 2))
+POSTGRES_POOL_MAX_SIZE = int(os.getenv("POSTGRES_POOL_MAX_SIZE", 10))
+POSTGRES_POOL_MAX_LIFETIME = float(os.getenv("POSTGRES_POOL_MAX_LIFETIME", 30 * 60))
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", 10))
+STREAM_BATCH_SIZE = 1000
 
-def get_cursor():
-    conn = psycopg.connect(
+pool = AsyncConnectionPool(
+    make_conninfo(
         dbname=POSTGRES_DB_NAME,
         user=POSTGRES_USER,
         password=POSTGRES_PASSWORD,
         host=POSTGRES_HOST,
-        autocommit=True,
-    )
+    ),
+    kwargs={"autocommit": True, "row_factory": namedtuple_row},
+    min_size=POSTGRES_POOL_MIN_SIZE,
+    max_size=POSTGRES_POOL_MAX_SIZE,
+    max_lifetime=POSTGRES_POOL_MAX_LIFETIME,
+    timeout=POSTGRES_POOL_TIMEOUT,
+    check=AsyncConnectionPool.check_connection,
+    name="lab2",
+    open=False,
+)
+
+
+async def open_pool():
+    await pool.open(wait=True)
+
+
+async def close_pool():
+    await pool.close()
+
+
+def get_pool_stats():
+    return pool.get_stats()
+
+
+async def get_db():
+    async with pool.connection() as conn:
+        async with conn.cursor() as cursor:
+            yield cursor
 
-    return conn.cursor(row_factory=namedtuple_row)
 
+async def stream_rows(query, params, batch_size=STREAM_BATCH_SIZE):
+    """Yield the rows of `query` from a server-side cursor.
 
-def get_db():
-    cursor = get_cursor()
+    The generator holds a pool connection until it is exhausted or closed,
+    so a caller that may stop early has to aclose() it.
+    """
+    conn = await pool.getconn()
     try:
-        yield cursor
+        # Server-side cursors only live inside a transaction.
+        async with conn.transaction():
+            cursor = conn.cursor(name="stream_rows")
+            try:
+                cursor.itersize = batch_size
+                await cursor.execute(query, params)
+                async for row in cursor:
+                    yield row
+            finally:
+                # A client disconnect cancels the response that iterates
+                # this generator; the cleanup must not be cancelled with it.
+                with anyio.CancelScope(shield=True):
+                    await cursor.close()
     finally:
-        cursor.close()
+        with anyio.CancelScope(shield=True):
+            await pool.putconn(conn)
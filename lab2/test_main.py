@@ -0,0 +1,125 @@
+import os
+
+import psycopg
+import pytest
+from fastapi.testclient import TestClient
+from psycopg.rows import namedtuple_row
+from psycopg_pool import AsyncConnectionPool
+
+import authorization
+import main
+import models
+from authorization import create_access_token, token_cache, user_cache
+
+# The queries are Postgres specific, so these tests run only against a
+# server given by POSTGRES_TEST_URL. Its tables are dropped and recreated.
+POSTGRES_TEST_URL = os.getenv("POSTGRES_TEST_URL")
+pytestmark = pytest.mark.skipif(
+    POSTGRES_TEST_URL is None, reason="needs a Postgres database at POSTGRES_TEST_URL"
+)
+
+SCHEMA = """
+    DROP TABLE IF EXISTS forecast_versions, forecasts, cities, countries, users;
+    CREATE TABLE users (
+        id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        hashed_password TEXT NOT NULL,
+        role TEXT NOT NULL DEFAULT 'user'
+    );
+    CREATE TABLE countries (id SERIAL PRIMARY KEY, name TEXT, code TEXT);
+    CREATE TABLE cities (
+        id SERIAL PRIMARY KEY, name TEXT, country_id INTEGER REFERENCES countries
+    );
+    CREATE TABLE forecasts (
+        id SERIAL PRIMARY KEY,
+        city_id INTEGER REFERENCES cities,
+        datetime TIMESTAMP,
+        forecasted_temperature DOUBLE PRECISION,
+        forecasted_humidity DOUBLE PRECISION
+    );
+    INSERT INTO users (username, email, hashed_password, role)
+    VALUES ('admin', 'admin@example.com', '', 'admin');
+    INSERT INTO countries (name, code) VALUES ('ukraine', 'ua');
+    INSERT INTO cities (name, country_id) VALUES ('kyiv', 1), ('lviv', 1);
+    INSERT INTO forecasts
+        (city_id, datetime, forecasted_temperature, forecasted_humidity)
+    VALUES (1, '2024-01-01', 1, 50), (1, '2024-01-02', 2, 50), (2, '2024-01-01', 3, 50);
+"""
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("SECRET_KEY", "test-secret")
+    monkeypatch.setenv("SUPERADMIN_EMAIL", "superadmin@example.com")
+    monkeypatch.setenv("SUPERADMIN_PASSWORD", "password")
+    user_cache.clear()
+    token_cache.clear()
+    with psycopg.connect(POSTGRES_TEST_URL, autocommit=True) as conn:
+        conn.execute(SCHEMA)
+    pool = AsyncConnectionPool(
+        POSTGRES_TEST_URL,
+        kwargs={"autocommit": True, "row_factory": namedtuple_row},
+        open=False,
+    )
+    monkeypatch.setattr(models, "pool", pool)
+    monkeypatch.setattr(authorization, "pool", pool)
+    monkeypatch.setattr(main, "pool", pool)
+    # Entered as a context manager, so the pool is opened on the app's loop.
+    with TestClient(main.app) as client:
+        client.cookies.set("token", create_access_token({"sub": "admin"}).access_token)
+        yield client
+
+
+def forecast(city_id, day):
+    return {
+        "city_id": city_id,
+        "forecast_datetime": f"2024-03-{day:02d}T00:00:00",
+        "forecasted_temperature": day,
+        "forecasted_humidity": 50,
+    }
+
+
+@pytest.mark.parametrize("path", ["/forecasts", "/forecasts/stream"])
+def test_forecast_page_is_revalidated_until_its_city_changes(client, path):
+    def get(etag=None):
+        headers = {} if etag is None else {"if-none-match": etag}
+        return client.get(path, params={"city_name": "kyiv"}, headers=headers)
+
+    page = get()
+    etag = page.headers["etag"]
+
+    assert page.status_code == 200
+    assert "last-modified" in page.headers
+    assert get(etag).status_code == 304
+
+    # Changes to another city's forecasts leave the page's ETag alone.
+    assert client.post("/forecasts", data=forecast(2, 1)).status_code == 200
+    assert client.post("/forecasts/3", data=forecast(2, 2)).status_code == 200
+    assert client.delete("/forecasts/3").status_code == 200
+    assert get(etag).status_code == 304
+
+    for change in (
+        lambda: client.post("/forecasts", data=forecast(1, 3)),
+        lambda: client.post("/forecasts/1", data=forecast(1, 4)),
+        lambda: client.delete("/forecasts/2"),
+    ):
+        assert change().status_code == 200
+        page = get(etag)
+        assert page.status_code == 200
+        assert page.headers["etag"] != etag
+        etag = page.headers["etag"]
+        assert get(etag).status_code == 304
+
+
+def test_streams_return_their_connection_to_the_pool(client):
+    for params in (
+        {"city_name": "kyiv"},
+        {"city_name": "kyiv", "format": "ndjson"},
+        {"city_name": "odesa"},
+    ):
+        client.get("/forecasts/stream", params=params)
+
+    stats = models.pool.get_stats()
+
+    assert stats["pool_available"] == stats["pool_size"]
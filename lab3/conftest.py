@@ -0,0 +1,6 @@
+import os
+from pathlib import Path
+
+# main.py finds "static" and "templates" relative to the working directory,
+# as it does when the app is started from lab3/.
+os.chdir(Path(__file__).parent)
@@ -1,17 +1,14 @@
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Literal
 
-import pymongo
-from bson import ObjectId
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request, HTTPException, Depends, status, Form
+from fastapi import FastAPI, Request, HTTPException, Depends, status, Form, Query
 from fastapi.exceptions import HTTPException as StarletteHTTPException
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pymongo.database import Database
 
 from authorization import (
     authenticate_user,
@@ -20,18 +17,35 @@ from authorization import (
     create_superadmin,
     get_superadmin,
     get_current_user,
-    get_password_hash
+    get_password_hash,
+    invalidate_user,
+    password_hasher,
 )
-from models import connect, get_db
+from models import close_client, get_db, open_client
+from repositories import (
+    CityRepository,
+    CountryRepository,
+    ForecastRepository,
+    UserRepository,
+    summarize_explain,
+)
+from static_assets import GZIP_MINIMUM_SIZE, PrecompressedStaticFiles
+from versions import is_not_modified, page_headers
 
 
 async def startup_event():
-    db = connect()
-    try:
-        create_superadmin(db)
-        create_example_user(db)
-    finally:
-        pass
+    open_client()
+    db = get_db()
+    for repository in (CityRepository, ForecastRepository):
+        await repository(db).create_indexes()
+    await CityRepository(db).create_missing_forecast_versions()
+    users = UserRepository(db)
+    await create_superadmin(users)
+    await create_example_user(users)
+
+
+async def shutdown_event():
+    close_client()
 
 
 app = FastAPI(
@@ -45,8 +59,12 @@ app = FastAPI(
 )
 
 app.add_event_handler("startup", startup_event)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.add_event_handler("shutdown", shutdown_event)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+static_files = PrecompressedStaticFiles(directory="static")
+app.mount("/static", static_files, name="static")
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["static_url"] = static_files.url
 
 
 @app.exception_handler(StarletteHTTPException)
@@ -62,24 +80,24 @@ async def http_exception_handler(
 
 
 @app.get("/", tags=["Forecasts"], response_class=HTMLResponse)
-def index(
+async def index(
     request: Request,
-    db: Annotated[Database, Depends(get_db)],
+    cities: Annotated[CityRepository, Depends()],
     user=Depends(get_current_user),
 ):
-    cities = list(db["cities"].find({}))
+    cities = await cities.all()
     return templates.TemplateResponse(
         name="index.html", request=request, context={"user": user, "cities": cities}
     )
 
 
 @app.get("/create-forecast", tags=["Forecasts"], response_class=HTMLResponse)
-def create_forecast(
+async def create_forecast(
     request: Request,
-    db: Annotated[Database, Depends(get_db)],
+    cities: Annotated[CityRepository, Depends()],
     user=Depends(get_superadmin),
 ):
-    cities = list(db["cities"].find({}))
+    cities = await cities.all()
     return templates.TemplateResponse(
         name="create_forecast.html",
         request=request,
@@ -88,12 +106,12 @@ def create_forecast(
 
 
 @app.get("/add-city", response_class=HTMLResponse)
-def add_city(
+async def add_city(
     request: Request,
-    db: Annotated[Database, Depends(get_db)],
+    countries: Annotated[CountryRepository, Depends()],
     user=Depends(get_superadmin),
 ):
-    countries = list(db["countries"].find({}))
+    countries = await countries.all()
     return templates.TemplateResponse(
         name="add_city.html",
         request=request,
@@ -102,7 +120,7 @@ def add_city(
 
 
 @app.get("/add-country", response_class=HTMLResponse)
-def add_country(
+async def add_country(
     request: Request,
     user=Depends(get_superadmin),
 ):
@@ -116,16 +134,15 @@ def add_country(
 @app.get(
     "/edit-forecast/{forecast_id}", tags=["Forecasts"], response_class=HTMLResponse
 )
-def edit_forecast(
+async def edit_forecast(
     request: Request,
     forecast_id: str,
-    db: Annotated[Database, Depends(get_db)],
+    forecasts: Annotated[ForecastRepository, Depends()],
+    cities: Annotated[CityRepository, Depends()],
     user=Depends(get_superadmin),
 ):
-    forecast = db["forecasts"].find_one(
-        {"_id": ObjectId(forecast_id)}
-    )  # Знайти прогноз за його ідентифікатором
-    cities = list(db["cities"].find({}))  # Отримати всі міста
+    forecast = await forecasts.get(forecast_id)  # Знайти прогноз за його ідентифікатором
+    cities = await cities.all()  # Отримати всі міста
     return templates.TemplateResponse(
         name="edit_forecast.html",
         request=request,
@@ -145,21 +162,23 @@ async def create_forecast(
     forecast_datetime: Annotated[datetime, Form()],
     forecasted_temperature: Annotated[float, Form()],
     forecasted_humidity: Annotated[float, Form()],
-    db: Annotated[Database, Depends(get_db)],
+    forecasts: Annotated[ForecastRepository, Depends()],
+    cities: Annotated[CityRepository, Depends()],
     user=Depends(get_superadmin),
 ):
-    city = db["cities"].find_one({"_id": ObjectId(city_id)})
+    city = await cities.get(city_id)
     if city is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="City not found"
         )
     forecast_data = {
-        "city_id": ObjectId(city_id),
+        "city_id": city["_id"],
         "datetime": forecast_datetime,
         "forecasted_temperature": forecasted_temperature,
         "forecasted_humidity": forecasted_humidity,
     }
-    db["forecasts"].insert_one(forecast_data)
+    await forecasts.insert(forecast_data)
+    await cities.bump_forecast_versions([city["_id"]])
 
     return templates.TemplateResponse(
         name="message.html",
@@ -177,11 +196,11 @@ async def add_country(
     request: Request,
     country_name: Annotated[str, Form()],
     country_code: Annotated[str, Form()],
-    db: Annotated[Database, Depends(get_db)],
+    countries: Annotated[CountryRepository, Depends()],
     user=Depends(get_superadmin),
 ):
     country_data = {"name": country_name.lower(), "code": country_code.lower()}
-    db["forecasts"].insert_one(country_data)
+    await countries.insert(country_data)
 
     return templates.TemplateResponse(
         name="message.html",
@@ -199,10 +218,11 @@ async def add_city(
     request: Request,
     country_id: Annotated[str, Form()],
     city_name: Annotated[str, Form()],
-    db: Annotated[Database, Depends(get_db)],
+    countries: Annotated[CountryRepository, Depends()],
+    cities: Annotated[CityRepository, Depends()],
     user=Depends(get_superadmin),
 ):
-    country = db["countries"].find_one({"_id": ObjectId(country_id)})
+    country = await countries.get(country_id)
     if country is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Country not found"
@@ -210,9 +230,9 @@ async def add_city(
 
     city_data = {
         "name": city_name.lower(),
-        "country_id": ObjectId(country_id),
+        "country_id": country["_id"],
     }
-    db["cities"].insert_one(city_data)
+    await cities.insert(city_data)
 
     return templates.TemplateResponse(
         name="message.html",
@@ -222,46 +242,42 @@ async def add_city(
 
 
 @app.get("/forecasts", tags=["Forecasts"], response_class=HTMLResponse)
-def get_forecast(
+async def get_forecast(
     request: Request,
     city_name: str,
-    db: Annotated[Database, Depends(get_db)],
+    cities: Annotated[CityRepository, Depends()],
     user=Depends(get_current_user),
     forecast_datetime_from: datetime | None = None,
     forecast_datetime_to: datetime | None = None,
+    sort_by: Literal[
+        "datetime", "forecasted_temperature", "forecasted_humidity"
+    ] = "datetime",
+    descending: bool = False,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int | None, Query(gt=0)] = None,
 ):
-    city = db["cities"].find_one(
-        {"name": {"$regex": f"^{city_name}$", "$options": "i"}}
+    headers = page_headers(
+        await cities.get_forecast_version(city_name),
+        city_name.lower(),
+        user["username"] if user else None,
+    )
+    if is_not_modified(request, headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    # Місто та його прогнози за один запит
+    city = await cities.get_with_forecasts(
+        city_name,
+        forecast_datetime_from,
+        forecast_datetime_to,
+        sort_by=sort_by,
+        descending=descending,
+        offset=offset,
+        limit=limit,
     )
     if not city:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="City not found"
         )
-
-    # Отримання прогнозів за містом та датами
-    forecasts = (
-        db["forecasts"]
-        .find(
-            {
-                "city_id": ObjectId(city["_id"]),
-                "datetime": {
-                    "$gte": (
-                        forecast_datetime_from
-                        if forecast_datetime_from is not None
-                        else datetime.min
-                    ),
-                    "$lte": (
-                        forecast_datetime_to
-                        if forecast_datetime_to is not None
-                        else datetime.max
-                    ),
-                },
-            }
-        )
-        .sort("datetime", pymongo.ASCENDING)
-    )
-
-    forecasts = list(forecasts)
+    forecasts = city["forecasts"]
 
     if len(forecasts) == 0:
         raise HTTPException(
@@ -277,6 +293,7 @@ def get_forecast(
             "forecast_datetime_to": forecast_datetime_to,
             "forecasts": forecasts,
         },
+        headers=headers,
     )
 
 
@@ -292,30 +309,31 @@ async def update_forecast(
     forecast_datetime: Annotated[datetime, Form()],
     forecasted_temperature: Annotated[float, Form()],
     forecasted_humidity: Annotated[float, Form()],
-    db: Annotated[Database, Depends(get_db)],
+    forecasts: Annotated[ForecastRepository, Depends()],
+    cities: Annotated[CityRepository, Depends()],
     user=Depends(get_superadmin),
 ):
-    if not db["forecasts"].find_one({"_id": ObjectId(forecast_id)}):
+    previous_forecast = await forecasts.get(forecast_id)
+    if not previous_forecast:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Forecast not found"
         )
 
     # Перевірка наявності міста за його ID
-    if not db["cities"].find_one({"_id": ObjectId(city_id)}):
+    city = await cities.get(city_id)
+    if not city:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="City not found"
         )
 
     # Оновлення прогнозу
-    update_result = db["forecasts"].update_one(
-        {"_id": ObjectId(forecast_id)},
+    update_result = await forecasts.update(
+        forecast_id,
         {
-            "$set": {
-                "city_id": ObjectId(city_id),
-                "datetime": forecast_datetime,
-                "forecasted_temperature": forecasted_temperature,
-                "forecasted_humidity": forecasted_humidity,
-            }
+            "city_id": city["_id"],
+            "datetime": forecast_datetime,
+            "forecasted_temperature": forecasted_temperature,
+            "forecasted_humidity": forecasted_humidity,
         },
     )
 
@@ -324,6 +342,7 @@ async def update_forecast(
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to update forecast"
         )
+    await cities.bump_forecast_versions([previous_forecast["city_id"], city["_id"]])
 
     return templates.TemplateResponse(
         name="message.html",
@@ -333,21 +352,21 @@ async def update_forecast(
 
 
 @app.delete("/forecasts/{forecast_id}", tags=["Forecasts"])
-def delete_forecast(
+async def delete_forecast(
     request: Request,
     forecast_id: str,
-    db: Annotated[Database, Depends(get_db)],
+    forecasts: Annotated[ForecastRepository, Depends()],
+    cities: Annotated[CityRepository, Depends()],
     user=Depends(get_superadmin),
 ):
-    deleted_forecast = db["forecasts"].find_one_and_delete(
-        {"_id": ObjectId(forecast_id)}
-    )
+    deleted_forecast = await forecasts.delete(forecast_id)
 
     # Перевірка, чи був видалений документ
     if not deleted_forecast:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Forecast not found"
         )
+    await cities.bump_forecast_versions([deleted_forecast["city_id"]])
 
     return templates.TemplateResponse(
         name="message.html",
@@ -356,6 +375,45 @@ def delete_forecast(
     )
 
 
+@app.get("/explain/forecasts", tags=["Monitoring"])
+async def explain_forecast(
+    city_name: str,
+    cities: Annotated[CityRepository, Depends()],
+    user=Depends(get_superadmin),
+    forecast_datetime_from: datetime | None = None,
+    forecast_datetime_to: datetime | None = None,
+    sort_by: Literal[
+        "datetime", "forecasted_temperature", "forecasted_humidity"
+    ] = "datetime",
+    descending: bool = False,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int | None, Query(gt=0)] = None,
+):
+    """Explain the aggregation GET /forecasts runs for the same parameters."""
+    city = await cities.get_by_name(city_name)
+    if not city:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="City not found"
+        )
+    params = dict(
+        datetime_from=forecast_datetime_from,
+        datetime_to=forecast_datetime_to,
+        sort_by=sort_by,
+        descending=descending,
+        offset=offset,
+        limit=limit,
+    )
+    return summarize_explain(
+        await cities.explain_get_with_forecasts(city_name, **params),
+        await cities.explain_forecasts_lookup(city["_id"], **params),
+    )
+
+
+@app.get("/password-hasher-stats", tags=["Monitoring"])
+async def password_hasher_stats(user=Depends(get_superadmin)):
+    return password_hasher.get_stats()
+
+
 @app.get("/login", tags=["Authorization"], response_class=HTMLResponse)
 async def login(request: Request):
     return templates.TemplateResponse(
@@ -374,9 +432,9 @@ async def logout():
 @app.post("/token", tags=["Authorization"], response_class=RedirectResponse)
 async def get_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Annotated[Database, Depends(get_db)],
+    users: Annotated[UserRepository, Depends()],
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(users, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -397,16 +455,16 @@ async def register_user(
     email: Annotated[str, Form()],
     password: Annotated[str, Form()],
     password_confirm: Annotated[str, Form()],
-    db: Annotated[Database, Depends(get_db)]
+    users: Annotated[UserRepository, Depends()],
 ):
-    existing_user = db["users"].find_one({"username": username})
+    existing_user = await users.get_by_username(username)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Such user already exists."
         )
     
-    existing_email =  db["users"].find_one({"email": email})
+    existing_email = await users.get_by_email(email)
     if existing_email:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -418,14 +476,15 @@ async def register_user(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Passwords do not match."
         )
-    hashed_password = get_password_hash(password)
+    hashed_password = await password_hasher.run(get_password_hash, password)
     new_user = {
         "username": username,
         "email": email,
         "hashed_password": hashed_password,
         "role": "user",
     }
-    db["users"].insert_one(new_user)
+    await users.insert(new_user)
+    invalidate_user(username)
     return templates.TemplateResponse(
         name="message.html",
         request=request,
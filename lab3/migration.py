@@ -1,64 +1,116 @@
+import argparse
 import sqlite3
+import time
 
+from bson import ObjectId
 from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 
 from models import User, Country, City, Forecast, connect
 
 SQLITE_DB_PATH = "../lab1/sqlite.db"
+BATCH_SIZE = 5000
+DUPLICATE_KEY_ERROR = 11000
 
 load_dotenv()
 
+# Tables in foreign key order: model class and {column index: referenced table}.
+TABLES = {
+    "users": (User, {}),
+    "countries": (Country, {}),
+    "cities": (City, {2: "countries"}),
+    "forecasts": (Forecast, {1: "cities"}),
+}
 
-def transform(data, class_name):
+
+def object_id(epoch, table_name, sqlite_id):
+    # Ids are derived from the SQLite ids, so the references can be mapped
+    # without any lookups and a resumed batch collides with the documents it
+    # already wrote instead of duplicating them.
+    table_index = list(TABLES).index(table_name)
+    return ObjectId(
+        epoch.to_bytes(4, "big")
+        + table_index.to_bytes(1, "big")
+        + sqlite_id.to_bytes(7, "big")
+    )
+
+
+def transform(data, class_name, epoch, table_name, references):
     transformed_data = []
     for entry in data:
-        obj = class_name(*(entry[1:]))
-        obj_dict = obj.__dict__
+        values = list(entry[1:])
+        for column, referenced_table in references.items():
+            values[column - 1] = object_id(epoch, referenced_table, entry[column])
+        obj_dict = class_name(*values).__dict__
+        obj_dict["_id"] = object_id(epoch, table_name, entry[0])
         transformed_data.append(obj_dict)
     return transformed_data
 
 
-if __name__ == "__main__":
-    sqlite_conn = sqlite3.connect(SQLITE_DB_PATH)
-    sqlite_cursor = sqlite_conn.cursor()
+def insert_batch(collection, documents):
+    try:
+        collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details["writeErrors"]
+        if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+
+
+def migrate_table(sqlite_conn, db, epoch, table_name, batch_size=BATCH_SIZE):
+    class_name, references = TABLES[table_name]
+    state = db["migration_state"].find_one({"_id": table_name}) or {}
+    last_id = state.get("last_id", 0)
+    if last_id:
+        print(f"{table_name}: resuming after id {last_id}")
+
+    sqlite_cursor = sqlite_conn.execute(
+        f"SELECT * FROM {table_name} WHERE id > ? ORDER BY id;", (last_id,)
+    )
+    migrated = 0
+    started = time.perf_counter()
+    while rows := sqlite_cursor.fetchmany(batch_size):
+        insert_batch(
+            db[table_name], transform(rows, class_name, epoch, table_name, references)
+        )
+        db["migration_state"].update_one(
+            {"_id": table_name}, {"$set": {"last_id": rows[-1][0]}}, upsert=True
+        )
+        migrated += len(rows)
+        elapsed = time.perf_counter() - started
+        print(f"{table_name}: {migrated} rows, {migrated / elapsed:.0f} rows/s")
+    print(f"{table_name}: done, {migrated} rows in {time.perf_counter() - started:.1f}s")
 
+
+def migrate(batch_size=BATCH_SIZE):
+    sqlite_conn = sqlite3.connect(SQLITE_DB_PATH)
     db = connect()
-    users_collection = db["users"]
-    countries_collection = db["countries"]
-    cities_collection = db["cities"]
-    forecasts_collection = db["forecasts"]
-
-    sqlite_cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = sqlite_cursor.fetchall()
-
-    for table in tables:
-        table_name = table[0]
-
-        sqlite_cursor.execute(f"SELECT * FROM {table_name};")
-        rows = sqlite_cursor.fetchall()
-        if table_name == "users":
-            users_collection.insert_many(transform(rows, User))
-        elif table_name == "countries":
-            countries_collection.insert_many(transform(rows, Country))
-        elif table_name == "cities":
-            newRows = []
-            sqlite_cursor.execute(f"SELECT * FROM countries;")
-            countryRows = sqlite_cursor.fetchall()
-            for i in rows:
-                sqlite_cursor.execute(f"SELECT name FROM countries WHERE id={i[2]};")
-                countryName = sqlite_cursor.fetchone()
-                print(countryName)
-                countryId = db["countries"].find_one({"name": countryName[0]})
-                newRows.append((i[0], i[1], countryId["_id"]))
-            cities_collection.insert_many(transform(newRows, City))
-        elif table_name == "forecasts":
-            newRows = []
-            sqlite_cursor.execute(f"SELECT * FROM cities;")
-            cityRows = sqlite_cursor.fetchall()
-            for i in rows:
-                print(i)
-                sqlite_cursor.execute(f"SELECT name FROM cities WHERE id={i[1]};")
-                cityName = sqlite_cursor.fetchone()
-                cityId = db["cities"].find_one({"name": cityName[0]})
-                newRows.append((i[0], cityId["_id"], i[2], i[3], i[4]))
-            forecasts_collection.insert_many(transform(newRows, Forecast))
+
+    # The epoch becomes the timestamp part of every id and has to survive a
+    # restart, otherwise resumed rows would reference different ids.
+    epoch = db["migration_state"].find_one_and_update(
+        {"_id": "epoch"},
+        {"$setOnInsert": {"value": int(time.time())}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )["value"]
+
+    sqlite_tables = {
+        row[0]
+        for row in sqlite_conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table';"
+        )
+    }
+    for table_name in TABLES:
+        if table_name in sqlite_tables:
+            migrate_table(sqlite_conn, db, epoch, table_name, batch_size)
+
+    sqlite_conn.close()
+    db.client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate lab1 SQLite data to MongoDB")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    migrate(batch_size=args.batch_size)
@@ -1,22 +1,52 @@
+import os
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from pymongo import MongoClient
 
+load_dotenv()
+
 MONGO_DB_HOST = "localhost"
 MONGO_DB_PORT = "27017"
 MONGO_DB_NAME = "lab3"
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 5 * 60 * 1000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
+)
+
+MONGO_URL = f"mongodb://{MONGO_DB_HOST}:{MONGO_DB_PORT}/"
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": MONGO_MAX_POOL_SIZE,
+    "minPoolSize": MONGO_MIN_POOL_SIZE,
+    "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+    "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+    "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+}
+
+client: AsyncIOMotorClient | None = None
 
 
 def connect():
-    client = MongoClient(f"mongodb://{MONGO_DB_HOST}:{MONGO_DB_PORT}/")
-    db = client[MONGO_DB_NAME]
-    return db
+    return MongoClient(MONGO_URL, **MONGO_CLIENT_OPTIONS)[MONGO_DB_NAME]
+
+
+def open_client():
+    global client
+    client = AsyncIOMotorClient(MONGO_URL, **MONGO_CLIENT_OPTIONS)
+
+
+def close_client():
+    global client
+    if client is not None:
+        client.close()
+        client = None
 
 
-def get_db():
-    db = connect()
-    try:
-        yield db
-    finally:
-        db.client.close()
+def get_db() -> AsyncIOMotorDatabase:
+    return client[MONGO_DB_NAME]
 
 
 class User:
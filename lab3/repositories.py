@@ -0,0 +1,267 @@
+from datetime import datetime
+from typing import Annotated
+
+import pymongo
+from bson import ObjectId
+from fastapi import Depends
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import IndexModel
+from pymongo.collation import Collation, CollationStrength
+
+from models import get_db
+
+
+# Case-insensitive comparison that, unlike a regex, can use an index.
+CASE_INSENSITIVE = Collation(locale="en", strength=CollationStrength.SECONDARY)
+
+
+def uses_index(plan: dict) -> bool:
+    return "COLLSCAN" not in str(plan)
+
+
+def find_values(document, key: str):
+    """Every value stored under `key` at any depth of an explain document."""
+    if isinstance(document, dict):
+        for name, value in document.items():
+            if name == key:
+                yield value
+            else:
+                yield from find_values(value, key)
+    elif isinstance(document, list):
+        for value in document:
+            yield from find_values(value, key)
+
+
+def sorts_in_memory(explain: dict) -> bool:
+    """Whether the winning plan sorts with a blocking SORT stage."""
+    plan = next(find_values(explain, "winningPlan"), {})
+    return "SORT" in set(find_values(plan, "stage"))
+
+
+def summarize_explain(explain: dict, lookup_explain: dict | None = None) -> dict:
+    """Index usage of the city match and of the forecasts $lookup.
+
+    The $lookup stage only reports totals, so whether its sort comes from an
+    index is read from `lookup_explain`, the plan of the query it runs.
+    """
+    city_plan = next(find_values(explain, "winningPlan"), {})
+    lookup = next(
+        (stage for stage in explain.get("stages", []) if "$lookup" in stage), {}
+    )
+    summary = {
+        "cities": {"uses_index": uses_index(city_plan), "winning_plan": city_plan},
+        "forecasts": {
+            "uses_index": bool(lookup.get("indexesUsed"))
+            and not lookup.get("collectionScans"),
+            "indexes_used": lookup.get("indexesUsed", []),
+            "keys_examined": lookup.get("totalKeysExamined"),
+            "docs_examined": lookup.get("totalDocsExamined"),
+        },
+    }
+    if lookup_explain is not None:
+        summary["forecasts"]["sorts_in_memory"] = sorts_in_memory(lookup_explain)
+    return summary
+
+
+class Repository:
+    collection_name: str
+    indexes: list[IndexModel] = []
+    # Names of indexes that `indexes` replaced and startup should drop.
+    obsolete_indexes: list[str] = []
+
+    def __init__(self, db: Annotated[AsyncIOMotorDatabase, Depends(get_db)]):
+        self.collection = db[self.collection_name]
+
+    async def get(self, document_id):
+        return await self.collection.find_one({"_id": ObjectId(document_id)})
+
+    async def all(self):
+        return await self.collection.find({}).to_list(None)
+
+    async def insert(self, document: dict):
+        return await self.collection.insert_one(document)
+
+    async def create_indexes(self):
+        if self.indexes:
+            await self.collection.create_indexes(self.indexes)
+        if self.obsolete_indexes:
+            existing = await self.collection.index_information()
+            for name in self.obsolete_indexes:
+                if name in existing:
+                    await self.collection.drop_index(name)
+
+
+class UserRepository(Repository):
+    collection_name = "users"
+
+    async def get_by_username(self, username: str):
+        return await self.collection.find_one({"username": username})
+
+    async def get_by_email(self, email: str):
+        return await self.collection.find_one({"email": email})
+
+
+class CountryRepository(Repository):
+    collection_name = "countries"
+
+
+class CityRepository(Repository):
+    collection_name = "cities"
+    indexes = [
+        IndexModel([("name", pymongo.ASCENDING)], collation=CASE_INSENSITIVE),
+    ]
+
+    async def get_by_name(self, name: str):
+        return await self.collection.find_one({"name": name}, collation=CASE_INSENSITIVE)
+
+    # A city's forecasts_version and forecasts_changed_at validate cached
+    # forecast pages. They are kept in the database so that every worker
+    # sees the same ones, and bumped after each forecast write.
+    async def bump_forecast_versions(self, city_ids):
+        await self.collection.update_many(
+            {"_id": {"$in": list(city_ids)}},
+            {
+                "$inc": {"forecasts_version": 1},
+                "$currentDate": {"forecasts_changed_at": True},
+            },
+        )
+
+    async def create_missing_forecast_versions(self):
+        # Cities never changed through the app get a first version.
+        await self.collection.update_many(
+            {"forecasts_version": {"$exists": False}},
+            {
+                "$set": {"forecasts_version": 1},
+                "$currentDate": {"forecasts_changed_at": True},
+            },
+        )
+
+    async def get_forecast_version(self, name: str):
+        city = await self.collection.find_one(
+            {"name": name},
+            {"forecasts_version": 1, "forecasts_changed_at": 1},
+            collation=CASE_INSENSITIVE,
+        )
+        if city is None or "forecasts_version" not in city:
+            return None
+        return city["forecasts_version"], city["forecasts_changed_at"]
+
+    @staticmethod
+    def _forecasts_pipeline(
+        datetime_from: datetime | None = None,
+        datetime_to: datetime | None = None,
+        sort_by: str = "datetime",
+        descending: bool = False,
+        offset: int = 0,
+        limit: int | None = None,
+    ):
+        forecasts_pipeline = []
+        datetime_range = {}
+        if datetime_from is not None:
+            datetime_range["$gte"] = datetime_from
+        if datetime_to is not None:
+            datetime_range["$lte"] = datetime_to
+        if datetime_range:
+            forecasts_pipeline.append({"$match": {"datetime": datetime_range}})
+        # The _id tie-break runs in the same direction so that a datetime sort
+        # is read straight off the (city_id, datetime, _id) index either way.
+        direction = pymongo.DESCENDING if descending else pymongo.ASCENDING
+        forecasts_pipeline.append({"$sort": {sort_by: direction, "_id": direction}})
+        if offset:
+            forecasts_pipeline.append({"$skip": offset})
+        if limit is not None:
+            forecasts_pipeline.append({"$limit": limit})
+        forecasts_pipeline.append(
+            {
+                "$project": {
+                    "datetime": 1,
+                    "forecasted_temperature": 1,
+                    "forecasted_humidity": 1,
+                }
+            }
+        )
+        return forecasts_pipeline
+
+    @classmethod
+    def _with_forecasts_pipeline(cls, name: str, *args, **kwargs):
+        return [
+            {"$match": {"name": name}},
+            {"$limit": 1},
+            {
+                "$lookup": {
+                    "from": ForecastRepository.collection_name,
+                    "localField": "_id",
+                    "foreignField": "city_id",
+                    "pipeline": cls._forecasts_pipeline(*args, **kwargs),
+                    "as": "forecasts",
+                }
+            },
+            {"$project": {"name": 1, "forecasts": 1}},
+        ]
+
+    async def get_with_forecasts(self, name: str, *args, **kwargs):
+        """Fetch a city and its forecasts in one round trip."""
+        pipeline = self._with_forecasts_pipeline(name, *args, **kwargs)
+        async for city in self.collection.aggregate(
+            pipeline, collation=CASE_INSENSITIVE
+        ):
+            return city
+        return None
+
+    async def explain_get_with_forecasts(self, name: str, *args, **kwargs):
+        return await self.collection.database.command(
+            "explain",
+            {
+                "aggregate": self.collection_name,
+                "pipeline": self._with_forecasts_pipeline(name, *args, **kwargs),
+                "collation": CASE_INSENSITIVE.document,
+                "cursor": {},
+            },
+            verbosity="executionStats",
+        )
+
+    async def explain_forecasts_lookup(self, city_id, *args, **kwargs):
+        """Explain the query the $lookup runs for the forecasts of `city_id`."""
+        return await self.collection.database.command(
+            "explain",
+            {
+                "aggregate": ForecastRepository.collection_name,
+                "pipeline": [
+                    {"$match": {"city_id": city_id}},
+                    *self._forecasts_pipeline(*args, **kwargs),
+                ],
+                "collation": CASE_INSENSITIVE.document,
+                "cursor": {},
+            },
+            verbosity="executionStats",
+        )
+
+
+class ForecastRepository(Repository):
+    collection_name = "forecasts"
+    indexes = [
+        IndexModel(
+            [
+                ("city_id", pymongo.ASCENDING),
+                ("datetime", pymongo.ASCENDING),
+                ("_id", pymongo.ASCENDING),
+            ],
+            # The $lookup in get_with_forecasts inherits the aggregate's
+            # collation, and an index only provides a sort for queries with
+            # the same one. None of the keys is a string, so the collation
+            # changes nothing else.
+            collation=CASE_INSENSITIVE,
+            name="city_id_1_datetime_1__id_1_ci",
+        ),
+    ]
+    obsolete_indexes = ["city_id_1_datetime_1", "city_id_1_datetime_1__id_1"]
+
+    async def update(self, forecast_id, document: dict):
+        return await self.collection.update_one(
+            {"_id": ObjectId(forecast_id)}, {"$set": document}
+        )
+
+    async def delete(self, forecast_id):
+        return await self.collection.find_one_and_delete(
+            {"_id": ObjectId(forecast_id)}
+        )
@@ -0,0 +1,487 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import models
+from authorization import get_password_hash, token_cache, user_cache
+from main import app, static_files
+from repositories import (
+    CityRepository,
+    CountryRepository,
+    ForecastRepository,
+    UserRepository,
+    summarize_explain,
+)
+
+# mongomock ignores collations and has no $lookup sub-pipelines; tests that
+# depend on them run only against a real server given by MONGO_TEST_URL.
+MONGO_TEST_URL = os.getenv("MONGO_TEST_URL")
+requires_mongod = pytest.mark.skipif(
+    MONGO_TEST_URL is None, reason="needs a mongod at MONGO_TEST_URL"
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    monkeypatch.setenv("SECRET_KEY", "test-secret")
+    user_cache.clear()
+    token_cache.clear()
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(models, "client", AsyncMongoMockClient())
+    return models.get_db()
+
+
+@pytest.fixture
+async def mongod_db():
+    client = AsyncIOMotorClient(MONGO_TEST_URL)
+    db = client["lab3_test"]
+    for repository in (CityRepository, ForecastRepository):
+        await repository(db).create_indexes()
+    yield db
+    await client.drop_database("lab3_test")
+    client.close()
+
+
+async def insert_city_with_forecasts(db):
+    country = await CountryRepository(db).insert({"name": "ukraine", "code": "ua"})
+    city = await CityRepository(db).insert(
+        {"name": "kyiv", "country_id": country.inserted_id}
+    )
+    forecasts = ForecastRepository(db)
+    for day, temperature in ((3, 10.0), (1, 30.0), (2, 20.0)):
+        await forecasts.insert(
+            {
+                "city_id": city.inserted_id,
+                "datetime": datetime(2024, 1, day),
+                "forecasted_temperature": temperature,
+                "forecasted_humidity": 50.0,
+            }
+        )
+    return city.inserted_id
+
+
+@pytest.mark.anyio
+async def test_repository_insert_get_and_all(db):
+    countries = CountryRepository(db)
+    result = await countries.insert({"name": "ukraine", "code": "ua"})
+    await countries.insert({"name": "poland", "code": "pl"})
+
+    country = await countries.get(str(result.inserted_id))
+
+    assert country["name"] == "ukraine"
+    assert [country["code"] for country in await countries.all()] == ["ua", "pl"]
+
+
+@pytest.mark.anyio
+async def test_user_repository_lookups(db):
+    users = UserRepository(db)
+    await users.insert({"username": "user", "email": "user@example.com"})
+
+    assert (await users.get_by_username("user"))["email"] == "user@example.com"
+    assert (await users.get_by_email("user@example.com"))["username"] == "user"
+    assert await users.get_by_username("nobody") is None
+
+
+@pytest.mark.anyio
+async def test_forecast_repository_update_and_delete(db):
+    await insert_city_with_forecasts(db)
+    forecasts = ForecastRepository(db)
+    forecast = (await forecasts.all())[0]
+
+    result = await forecasts.update(
+        str(forecast["_id"]), {"forecasted_temperature": -5.0}
+    )
+    deleted = await forecasts.delete(str(forecast["_id"]))
+
+    assert result.modified_count == 1
+    assert deleted["forecasted_temperature"] == -5.0
+    assert await forecasts.get(str(forecast["_id"])) is None
+    assert len(await forecasts.all()) == 2
+
+
+@pytest.mark.anyio
+async def test_forecast_versions_are_stored_with_the_city(db):
+    city_id = await insert_city_with_forecasts(db)
+    await CityRepository(db).insert({"name": "lviv"})
+    cities = CityRepository(db)
+
+    await cities.create_missing_forecast_versions()
+    first, changed_at = await cities.get_forecast_version("kyiv")
+    await cities.bump_forecast_versions([city_id])
+    # Another worker reads the version from the database, not from memory.
+    version = await CityRepository(db).get_forecast_version("kyiv")
+
+    assert first == 1
+    assert version[0] == 2
+    assert version[1] >= changed_at
+    assert (await cities.get_forecast_version("lviv"))[0] == 1
+    assert await cities.get_forecast_version("odesa") is None
+
+
+@pytest.mark.anyio
+async def test_create_indexes_replaces_obsolete_ones(db):
+    forecasts = ForecastRepository(db)
+    await forecasts.collection.create_index([("city_id", 1), ("datetime", 1)])
+    await forecasts.collection.create_index(
+        [("city_id", 1), ("datetime", 1), ("_id", 1)]
+    )
+
+    await forecasts.create_indexes()
+    indexes = await forecasts.collection.index_information()
+
+    assert "city_id_1_datetime_1" not in indexes
+    assert "city_id_1_datetime_1__id_1" not in indexes
+    assert list(indexes["city_id_1_datetime_1__id_1_ci"]["key"]) == [
+        ("city_id", 1),
+        ("datetime", 1),
+        ("_id", 1),
+    ]
+
+
+def test_summarize_explain():
+    explain = {
+        "stages": [
+            {
+                "$cursor": {
+                    "queryPlanner": {
+                        "winningPlan": {
+                            "stage": "LIMIT",
+                            "inputStage": {
+                                "stage": "FETCH",
+                                "inputStage": {
+                                    "stage": "IXSCAN",
+                                    "indexName": "name_1",
+                                },
+                            },
+                        }
+                    }
+                }
+            },
+            {
+                "$lookup": {"from": "forecasts", "as": "forecasts"},
+                "totalDocsExamined": 3,
+                "totalKeysExamined": 3,
+                "collectionScans": 0,
+                "indexesUsed": ["city_id_1_datetime_1__id_1_ci"],
+            },
+            {"$project": {"name": True, "forecasts": True}},
+        ]
+    }
+
+    summary = summarize_explain(explain)
+
+    assert summary["cities"]["uses_index"]
+    assert summary["forecasts"] == {
+        "uses_index": True,
+        "indexes_used": ["city_id_1_datetime_1__id_1_ci"],
+        "keys_examined": 3,
+        "docs_examined": 3,
+    }
+
+
+def test_summarize_explain_reports_collection_scans():
+    explain = {
+        "stages": [
+            {"$cursor": {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}},
+            {"$lookup": {}, "collectionScans": 1, "indexesUsed": []},
+        ]
+    }
+
+    summary = summarize_explain(explain)
+
+    assert not summary["cities"]["uses_index"]
+    assert not summary["forecasts"]["uses_index"]
+
+
+def test_summarize_explain_reports_in_memory_sorts():
+    explain = {"stages": [{"$lookup": {}, "indexesUsed": ["city_id_1"]}]}
+    lookup_explain = {
+        "queryPlanner": {
+            "winningPlan": {
+                "stage": "SORT",
+                "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+            },
+            "rejectedPlans": [],
+        }
+    }
+    indexed_sort = {
+        "queryPlanner": {
+            "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+            "rejectedPlans": [{"stage": "SORT"}],
+        }
+    }
+
+    assert summarize_explain(explain, lookup_explain)["forecasts"]["sorts_in_memory"]
+    assert not summarize_explain(explain, indexed_sort)["forecasts"]["sorts_in_memory"]
+    assert "sorts_in_memory" not in summarize_explain(explain)["forecasts"]
+
+
+@requires_mongod
+@pytest.mark.anyio
+async def test_explain_get_with_forecasts_uses_indexes(mongod_db):
+    city_id = await insert_city_with_forecasts(mongod_db)
+    cities = CityRepository(mongod_db)
+    params = {"datetime_from": datetime(2024, 1, 2), "descending": True}
+
+    summary = summarize_explain(
+        await cities.explain_get_with_forecasts("KYIV", **params),
+        await cities.explain_forecasts_lookup(city_id, **params),
+    )
+
+    assert summary["cities"]["uses_index"]
+    assert summary["forecasts"]["uses_index"]
+    assert summary["forecasts"]["indexes_used"] == ["city_id_1_datetime_1__id_1_ci"]
+    # The sort is read off the index, not done in memory.
+    assert not summary["forecasts"]["sorts_in_memory"]
+
+
+@requires_mongod
+@pytest.mark.anyio
+async def test_get_by_name_ignores_case(mongod_db):
+    await insert_city_with_forecasts(mongod_db)
+
+    city = await CityRepository(mongod_db).get_by_name("KYIV")
+
+    assert city["name"] == "kyiv"
+
+
+@requires_mongod
+@pytest.mark.anyio
+async def test_get_with_forecasts(mongod_db):
+    await insert_city_with_forecasts(mongod_db)
+    cities = CityRepository(mongod_db)
+
+    in_range = await cities.get_with_forecasts(
+        "Kyiv", datetime_from=datetime(2024, 1, 2)
+    )
+    by_temperature = await cities.get_with_forecasts(
+        "kyiv", sort_by="forecasted_temperature", descending=True, offset=1, limit=1
+    )
+
+    assert [forecast["datetime"].day for forecast in in_range["forecasts"]] == [2, 3]
+    assert [
+        forecast["forecasted_temperature"] for forecast in by_temperature["forecasts"]
+    ] == [20.0]
+    assert await cities.get_with_forecasts("lviv") is None
+
+
+@pytest.fixture
+def client(db):
+    # Not entered as a context manager, so startup does not open a real client.
+    return TestClient(app)
+
+
+def insert_user(db, username, role="user", password="password"):
+    asyncio.run(
+        UserRepository(db).insert(
+            {
+                "username": username,
+                "email": f"{username}@example.com",
+                "hashed_password": get_password_hash(password),
+                "role": role,
+            }
+        )
+    )
+
+
+def log_in(client, username, password="password"):
+    return client.post(
+        "/token",
+        data={"username": username, "password": password},
+        follow_redirects=False,
+    )
+
+
+def test_register_log_in_and_log_out(client):
+    registered = client.post(
+        "/register",
+        data={
+            "username": "user",
+            "email": "user@example.com",
+            "password": "password",
+            "password_confirm": "password",
+        },
+    )
+    logged_in = log_in(client, "user")
+    index = client.get("/")
+    logged_out = client.get("/logout", follow_redirects=False)
+    client.cookies.clear()
+
+    assert "User registered successfully" in registered.text
+    assert logged_in.status_code == 302
+    assert "token" in logged_in.cookies
+    assert "Logged in as user" in index.text
+    assert 'token=""' in logged_out.headers["set-cookie"]
+    assert "Logged in as" not in client.get("/").text
+
+
+def test_register_rejects_taken_username(client, db):
+    insert_user(db, "user")
+
+    response = client.post(
+        "/register",
+        data={
+            "username": "user",
+            "email": "other@example.com",
+            "password": "password",
+            "password_confirm": "password",
+        },
+    )
+
+    assert "Such user already exists." in response.text
+
+
+def test_log_in_with_wrong_password(client, db):
+    insert_user(db, "user")
+
+    response = log_in(client, "user", password="wrong")
+
+    assert "Incorrect username or password" in response.text
+    assert "token" not in response.cookies
+
+
+def test_invalid_token_is_rejected(client):
+    client.cookies.set("token", "not-a-jwt")
+
+    response = client.get("/")
+
+    assert "Could not validate credentials" in response.text
+
+
+def test_admin_pages_need_the_admin_role(client, db):
+    insert_user(db, "user")
+    insert_user(db, "admin", role="admin")
+
+    log_in(client, "user")
+    as_user = client.get("/add-country")
+    log_in(client, "admin")
+    as_admin = client.get("/add-country")
+
+    assert "enough privileges" in as_user.text
+    assert as_admin.status_code == 200
+    assert "enough privileges" not in as_admin.text
+
+
+def test_current_user_is_cached(client, db):
+    insert_user(db, "user")
+    log_in(client, "user")
+    client.get("/")
+    asyncio.run(UserRepository(db).collection.delete_many({}))
+
+    # The user is served from the cache until invalidated or expired.
+    assert "Logged in as user" in client.get("/").text
+
+
+def test_registering_a_user_invalidates_its_cache_entry(client, db):
+    insert_user(db, "user", role="admin")
+    log_in(client, "user")
+    client.get("/")
+    asyncio.run(UserRepository(db).collection.delete_many({}))
+
+    client.post(
+        "/register",
+        data={
+            "username": "user",
+            "email": "user@example.com",
+            "password": "password",
+            "password_confirm": "password",
+        },
+    )
+
+    assert "enough privileges" in client.get("/add-country").text
+
+
+def test_hashed_static_assets_only_answer_get_and_head(client):
+    path = f"/static/{static_files.manifest['style.css']}"
+
+    got = client.get(path)
+    posted = client.post(path)
+
+    assert got.status_code == 200
+    assert got.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert client.head(path).status_code == 200
+    assert posted.status_code == 405
+    assert client.delete(path).status_code == 405
+
+
+async def get_with_forecasts_without_lookup(self, name, *args, **kwargs):
+    city = await self.collection.find_one({"name": name.lower()})
+    if city is not None:
+        forecasts = ForecastRepository(self.collection.database).collection
+        city["forecasts"] = await forecasts.find({"city_id": city["_id"]}).to_list(None)
+    return city
+
+
+def test_forecast_page_is_revalidated_until_its_city_changes(client, db, monkeypatch):
+    # The page itself is not under test, only its validators.
+    monkeypatch.setattr(
+        CityRepository, "get_with_forecasts", get_with_forecasts_without_lookup
+    )
+    kyiv = str(asyncio.run(insert_city_with_forecasts(db)))
+    lviv = str(asyncio.run(CityRepository(db).insert({"name": "lviv"})).inserted_id)
+    asyncio.run(CityRepository(db).create_missing_forecast_versions())
+    forecast_ids = [
+        str(forecast["_id"]) for forecast in asyncio.run(ForecastRepository(db).all())
+    ]
+    insert_user(db, "admin", role="admin")
+    log_in(client, "admin")
+
+    def get(etag=None):
+        headers = {} if etag is None else {"if-none-match": etag}
+        return client.get("/forecasts", params={"city_name": "kyiv"}, headers=headers)
+
+    def forecast(city_id, day):
+        return {
+            "city_id": city_id,
+            "forecast_datetime": f"2024-03-{day:02d}T00:00:00",
+            "forecasted_temperature": day,
+            "forecasted_humidity": 50,
+        }
+
+    def lviv_forecast_id():
+        return str(
+            asyncio.run(
+                ForecastRepository(db).collection.find_one({"city_id": ObjectId(lviv)})
+            )["_id"]
+        )
+
+    page = get()
+    etag = page.headers["etag"]
+
+    assert page.status_code == 200
+    assert "last-modified" in page.headers
+    assert get(etag).status_code == 304
+
+    # Changes to another city's forecasts leave the page's ETag alone.
+    assert client.post("/forecasts", data=forecast(lviv, 1)).status_code == 200
+    assert (
+        client.post(f"/forecasts/{lviv_forecast_id()}", data=forecast(lviv, 2))
+    ).status_code == 200
+    assert client.delete(f"/forecasts/{lviv_forecast_id()}").status_code == 200
+    assert get(etag).status_code == 304
+
+    for change in (
+        lambda: client.post("/forecasts", data=forecast(kyiv, 3)),
+        lambda: client.post(f"/forecasts/{forecast_ids[0]}", data=forecast(kyiv, 4)),
+        lambda: client.delete(f"/forecasts/{forecast_ids[1]}"),
+    ):
+        assert change().status_code == 200
+        page = get(etag)
+        assert page.status_code == 200
+        assert page.headers["etag"] != etag
+        etag = page.headers["etag"]
+        assert get(etag).status_code == 304